@@ -0,0 +1,165 @@
+"""JSON API.
+
+Collection endpoints stream one JSON document per row (NDJSON) straight
+from a server-side cursor, so the first bytes go out immediately and a
+full-table export uses constant memory. Pass ?format=json to get the
+same rows as a single chunked JSON array instead, and ?after_id=N to
+resume after the last id already received. /api/search returns one page
+of search results, and POST /api/tags/<id>/posts tags posts in bulk.
+"""
+
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, request, stream_with_context, jsonify, abort
+from sqlalchemy import select
+
+from models import db, User, Post, Tag, PostTag
+from page_cache import invalidate_tag_pages
+from search import search_from_request
+from counters import bump_tag_posts
+from tagging import add_tag_to_posts, remove_tag_from_posts
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+YIELD_PER = 1000
+
+USER_COLUMNS = (User.id, User.first_name, User.last_name, User.image_url)
+POST_SUMMARY_COLUMNS = (Post.id, Post.title, Post.excerpt, Post.created_at, Post.user_id)
+TAG_COLUMNS = (Tag.id, Tag.tag_name)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"cannot serialize {type(value).__name__}")
+
+
+def _dumps(row):
+    return json.dumps(row, default=_default, separators=(",", ":"))
+
+
+def _ndjson(rows):
+    for row in rows:
+        yield _dumps(row) + "\n"
+
+
+def _json_array(rows):
+    yield "["
+    first = True
+    for row in rows:
+        yield ("" if first else ",") + _dumps(row)
+        first = False
+    yield "]\n"
+
+
+def stream_rows(stmt, id_column):
+    """Stream stmt's rows, in id order, as NDJSON or a chunked JSON array."""
+
+    after_id = request.args.get("after_id", type=int)
+    if after_id is not None:
+        stmt = stmt.where(id_column > after_id)
+    stmt = stmt.order_by(id_column).execution_options(yield_per=YIELD_PER)
+
+    def rows():
+        for row in db.session.execute(stmt):
+            yield row._asdict()
+
+    if request.args.get("format") == "json":
+        return Response(stream_with_context(_json_array(rows())),
+                        mimetype="application/json")
+    return Response(stream_with_context(_ndjson(rows())),
+                    mimetype="application/x-ndjson")
+
+
+def _one(stmt):
+    row = db.session.execute(stmt).first()
+    if row is None:
+        abort(404)
+    return row._asdict()
+
+
+@api.route("/users")
+def list_users():
+    """Stream every user."""
+    return stream_rows(select(*USER_COLUMNS), User.id)
+
+
+@api.route("/users/<int:user_id>")
+def get_user(user_id):
+    """Return one user."""
+    return jsonify(_one(select(*USER_COLUMNS).where(User.id == user_id)))
+
+
+@api.route("/users/<int:user_id>/posts")
+def list_user_posts(user_id):
+    """Stream a user's post summaries."""
+    return stream_rows(select(*POST_SUMMARY_COLUMNS).where(Post.user_id == user_id), Post.id)
+
+
+@api.route("/posts")
+def list_posts():
+    """Stream every post summary; bodies are only served one post at a time."""
+    return stream_rows(select(*POST_SUMMARY_COLUMNS), Post.id)
+
+
+@api.route("/posts/<int:post_id>")
+def get_post(post_id):
+    """Return one post with its body and tag ids."""
+    post = _one(select(*POST_SUMMARY_COLUMNS, Post.content).where(Post.id == post_id))
+    post["tag_ids"] = list(db.session.scalars(
+        select(PostTag.tag_id).where(PostTag.post_id == post_id).order_by(PostTag.tag_id)))
+    return Response(_dumps(post), mimetype="application/json")
+
+
+@api.route("/tags")
+def list_tags():
+    """Stream every tag."""
+    return stream_rows(select(*TAG_COLUMNS), Tag.id)
+
+
+@api.route("/tags/<int:tag_id>/posts", methods=["GET"])
+def list_tag_posts(tag_id):
+    """Stream the post summaries carrying a tag."""
+    stmt = (select(*POST_SUMMARY_COLUMNS)
+            .join(PostTag, PostTag.post_id == Post.id)
+            .where(PostTag.tag_id == tag_id))
+    return stream_rows(stmt, Post.id)
+
+
+@api.route("/tags/<int:tag_id>/posts", methods=["POST"])
+def bulk_tag_posts(tag_id):
+    """Apply and/or remove a tag across many posts in one transaction.
+
+    Expects a JSON body like {"add": [post ids], "remove": [post ids]}.
+    """
+    tag = Tag.query.get_or_404(tag_id)
+    data = request.get_json(force=True)
+    try:
+        add_ids = [int(num) for num in data.get("add", [])]
+        remove_ids = [int(num) for num in data.get("remove", [])]
+    except (AttributeError, TypeError, ValueError):
+        abort(400)
+
+    added = add_tag_to_posts(tag.id, add_ids)
+    removed = remove_tag_from_posts(tag.id, remove_ids)
+    bump_tag_posts([tag.id], len(added) - len(removed))
+    db.session.commit()
+
+    invalidate_tag_pages([tag_id])
+    return jsonify(tag_id=tag.id, added=sorted(added), removed=sorted(removed))
+
+
+@api.route("/search")
+def search():
+    """Return posts matching a full-text query as JSON."""
+    results = search_from_request()
+    return jsonify(query=results.query,
+                   page=results.page,
+                   next_page=results.page + 1 if results.has_next else None,
+                   results=[{"id": post.id,
+                             "title": post.title,
+                             "user_id": post.user_id,
+                             "author": post.user.full_name,
+                             "created_at": post.created_at.isoformat()}
+                            for post in results])
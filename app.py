@@ -1,124 +1,223 @@
 """Blogly application."""
 
-from flask import Flask, render_template, request, session, redirect
-from flask_debugtoolbar import DebugToolbarExtension
-from models import db, connect_db, User, Post, Tag
-
-app = Flask(__name__)
-
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SECRET_KEY'] = "123"
-debug = DebugToolbarExtension(app)
-
-app.app_context().push()
-connect_db(app)
-
-@app.route('/')
+import os
+
+from flask import Flask, Blueprint, render_template, request, session, redirect, abort
+from flask_migrate import Migrate
+from sqlalchemy import delete
+from sqlalchemy.orm import joinedload, selectinload, undefer
+from config import PROFILES
+from models import db, connect_db, User, Post, Tag, PostTag, user_summaries, post_summaries
+from pagination import paginate_request
+from metrics import init_metrics
+from page_cache import PageCache, page_cache, cached_page, init_page_cache, invalidate_tag_pages
+from routing import init_routing
+from avatars import init_avatars, save_upload, InvalidAvatar
+from bulk import blogly_cli
+from benchmark import bench_cli
+from search import search_from_request, index_post, unindex_posts, include_object
+from api import api
+from counters import bump_user_posts, bump_tag_posts, bump_tags_by, tag_link_counts_of_user
+from tagging import link_post_tags, set_post_tags, set_tag_posts
+from catalog import tag_catalog, bump_catalog_version
+
+bp = Blueprint("blogly", __name__)
+
+def create_app(profile=None, config=None):
+    """Build a Blogly app for the "dev", "test" or "prod" profile.
+
+    The profile defaults to $BLOGLY_PROFILE, then "dev". Settings in
+    config override the profile's.
+    """
+    profile = profile or os.environ.get("BLOGLY_PROFILE", "dev")
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile])
+    app.config.update(config or {})
+    if not app.config["SECRET_KEY"]:
+        raise RuntimeError(f"SECRET_KEY must be set for the {profile} profile")
+
+    if app.config["DEBUG_TOOLBAR"]:
+        # Imported here so non-dev workers never load the toolbar.
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    Migrate(app, db, include_object=include_object)
+    init_metrics(app)
+    init_page_cache(app)
+    init_routing(app)
+    init_avatars(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+    app.cli.add_command(blogly_cli)
+    app.cli.add_command(bench_cli)
+    return app
+
+def post_ids_of_user(user_id):
+    return [post_id for (post_id,) in db.session.query(Post.id).filter_by(user_id=user_id)]
+
+def tag_ids_of_posts(post_ids):
+    return {tag_id for (tag_id,) in
+            db.session.query(PostTag.tag_id).filter(PostTag.post_id.in_(post_ids)).distinct()}
+
+def post_page_groups(post_id):
+    """Post pages show their author and tags, so they follow those pages' versions.
+
+    Every write that changes a post also invalidates its author's and tags'
+    pages, so post pages need no page_versions rows of their own.
+    """
+    user_id = db.session.query(Post.user_id).filter_by(id=post_id).scalar()
+    tag_ids = [tag_id for (tag_id,) in
+               db.session.query(PostTag.tag_id).filter_by(post_id=post_id).order_by(PostTag.tag_id)]
+    return ([PageCache.group_key('blogly.show_user', user_id=user_id)] +
+            [PageCache.group_key('blogly.show_tag_details', tag_id=tag_id) for tag_id in tag_ids])
+
+@bp.route('/')
 def root():
     """Redirects to list of users."""
     return redirect("/users")
 
-@app.route('/users')
+@bp.route('/users')
+@cached_page
 def list_users():
-    """Show list of all users in db."""
-    users = User.query.all()
-    return render_template('users.html', users=users)
-
-@app.route('/<int:user_id>')
+    """Show list of all users in db, optionally most active first."""
+    sort = request.args.get("sort")
+    if sort == "popular":
+        users = paginate_request(user_summaries(), [User.post_count, User.id], descending=True)
+    else:
+        sort = None
+        users = paginate_request(user_summaries(), [User.id])
+    return render_template('users.html', users=users, sort=sort)
+
+@bp.route('/<int:user_id>')
+@cached_page
 def show_user(user_id):
     """Show details about a single user."""
     user = User.query.get_or_404(user_id)
-    return render_template('details.html', user=user)
+    posts = paginate_request(post_summaries().filter(Post.user_id == user.id),
+                             [Post.created_at, Post.id], descending=True)
+    return render_template('details.html', user=user, posts=posts)
 
-@app.route('/new_user', methods=["GET"])
+@bp.route('/new_user', methods=["GET"])
 def new_user_form():
     "Shows the new user form."
     return render_template('new_user.html')
 
-@app.route('/new_user', methods=["POST"])
+@bp.route('/new_user', methods=["POST"])
 def create_user():
     """Handle the new user form."""
     first_name = request.form["first_name"]
     last_name = request.form["last_name"]
     image_url = request.form["image_url"] or None
+    try:
+        avatar = save_upload(request.files.get("avatar"))
+    except InvalidAvatar:
+        abort(400)
 
-    new_user = User(first_name=first_name, last_name=last_name, image_url=image_url)
+    new_user = User(first_name=first_name, last_name=last_name, image_url=image_url,
+                    avatar=avatar)
     db.session.add(new_user)
     db.session.commit()
+    page_cache.invalidate('blogly.list_users')
 
     return redirect("/users")
 
-@app.route('/users/<int:user_id>/edit')
+@bp.route('/users/<int:user_id>/edit')
 def edit_user_form(user_id):
     """Shows the edit user form."""
     user = User.query.get_or_404(user_id)
     return render_template('edit_user.html', user=user)
 
-@app.route('/users/<int:user_id>/edit', methods=["POST"])
+@bp.route('/users/<int:user_id>/edit', methods=["POST"])
 def handle_edit_user_form(user_id):
     """Handle the edit user form."""
     user = User.query.get_or_404(user_id)
     user.first_name = request.form["first_name"]
     user.last_name = request.form["last_name"]
     user.image_url = request.form["image_url"]
+    try:
+        user.avatar = save_upload(request.files.get("avatar")) or user.avatar
+    except InvalidAvatar:
+        abort(400)
 
     db.session.add(user)
     db.session.commit()
+    page_cache.invalidate('blogly.list_users')
+    page_cache.invalidate('blogly.show_user', user_id=user_id)
+    # Tag pages show the author's name too.
+    invalidate_tag_pages(tag_link_counts_of_user(user_id))
 
     return redirect("/users")
 
-@app.route('/users/<int:user_id>/delete', methods=["POST"])
+@bp.route('/users/<int:user_id>/delete', methods=["POST"])
 def handle_delete_user(user_id):
-    """Deletes the user."""
-    user = User.query.get_or_404(user_id)
-
-    db.session.delete(user)
+    """Deletes the user; the database cascades to their posts and post tags."""
+    post_ids = post_ids_of_user(user_id)
+    tag_counts = tag_link_counts_of_user(user_id)
+    tag_ids = set(tag_counts)
+
+    if db.session.execute(delete(User).where(User.id == user_id)).rowcount == 0:
+        abort(404)
+    bump_tags_by({tag_id: -count for tag_id, count in tag_counts.items()})
     db.session.commit()
+    page_cache.invalidate('blogly.list_users')
+    page_cache.invalidate('blogly.show_user', user_id=user_id)
+    invalidate_tag_pages(tag_ids)
+    unindex_posts(post_ids)
 
     return redirect("/users")
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 """Post routes"""
 
-@app.route('/users/<int:user_id>/posts_new')
+@bp.route('/users/<int:user_id>/posts_new')
 def user_post_form(user_id):
     """Shows the user post form."""
     user = User.query.get_or_404(user_id)
-    tags = Tag.query.all()
-    return render_template('posts_new.html', user=user, tags=tags)
+    return render_template('posts_new.html', user=user, tags=tag_catalog.tags())
 
-@app.route('/users/<int:user_id>/posts_new', methods=["POST"])
+@bp.route('/users/<int:user_id>/posts_new', methods=["POST"])
 def handle_new_post(user_id):
     """Handle the user new post form."""
     user = User.query.get_or_404(user_id)
-    tag_ids = [int(num) for num in request.form.getlist("tags")] 
-    tags = Tag.query.filter(Tag.id.in_(tag_ids)).all()
+    tag_ids = tag_catalog.existing(int(num) for num in request.form.getlist("tags"))
 
     new_post = Post(title=request.form['post_title'],
                     content=request.form['post_content'],
-                    user=user,
-                    tags=tags)
+                    user=user)
     
     db.session.add(new_post)
+    db.session.flush()
+    link_post_tags(new_post.id, tag_ids)
+    bump_user_posts(user_id, 1)
+    bump_tag_posts(tag_ids, 1)
     db.session.commit()
+    page_cache.invalidate('blogly.list_users')
+    page_cache.invalidate('blogly.show_user', user_id=user_id)
+    invalidate_tag_pages(tag_ids)
+    index_post(new_post)
     return redirect("/users")
 
-@app.route('/posts/<post_id>')
+@bp.route('/posts/<post_id>')
+@cached_page(version_groups=post_page_groups)
 def post_details(post_id):
     """Show the details for the post."""
-    post = Post.query.get_or_404(post_id)
+    post = (Post.query
+            .options(undefer(Post.content), joinedload(Post.user), selectinload(Post.tags))
+            .get_or_404(post_id))
     return render_template('posts.html', post=post)
 
-@app.route('/posts/<post_id>/edit')
+@bp.route('/posts/<post_id>/edit')
 def edit_post(post_id):
     """Show the edit post form."""
-    post = Post.query.get_or_404(post_id)
-    tags = Tag.query.all()
-    return render_template('edit_post.html', post=post, tags=tags)
-
-@app.route('/posts/<post_id>/edit', methods=["POST"])
+    post = Post.query.options(undefer(Post.content)).get_or_404(post_id)
+    tags = tag_catalog.tags()
+    selected_tag_ids = {tag_id for (tag_id,) in
+                        db.session.query(PostTag.tag_id).filter_by(post_id=post.id)}
+    return render_template('edit_post.html', post=post, tags=tags,
+                           selected_tag_ids=selected_tag_ids)
+
+@bp.route('/posts/<post_id>/edit', methods=["POST"])
 def hanlde_edit_post(post_id):
     """Handle the edit post form."""
     post = Post.query.get_or_404(post_id)
@@ -126,81 +225,119 @@ def hanlde_edit_post(post_id):
     post.content = request.form["post_content"]
 
     tags_id = [int(num) for num in request.form.getlist("tags")]
-    post.tags = Tag.query.filter(Tag.id.in_(tags_id)).all()
+    added, removed = set_post_tags(post.id, tags_id)
+    bump_tag_posts(added, 1)
+    bump_tag_posts(removed, -1)
 
     db.session.add(post)
     db.session.commit()
+    page_cache.invalidate('blogly.show_user', user_id=post.user_id)
+    invalidate_tag_pages(set(tags_id) | removed)
+    index_post(post)
     return redirect(f"/tags")
 
-@app.route('/posts/<post_id>/delete', methods=["POST"])
+@bp.route('/posts/<post_id>/delete', methods=["POST"])
 def delete_post(post_id):
-    """Delete post."""
-    post = Post.query.get_or_404(post_id)
-
-    db.session.delete(post)
+    """Delete post; the database cascades to its post tags."""
+    tag_ids = tag_ids_of_posts([post_id])
+
+    user_id = db.session.execute(delete(Post)
+                                 .where(Post.id == post_id)
+                                 .returning(Post.user_id)).scalar_one_or_none()
+    if user_id is None:
+        abort(404)
+    bump_user_posts(user_id, -1)
+    bump_tag_posts(tag_ids, -1)
     db.session.commit()
+    page_cache.invalidate('blogly.list_users')
+    page_cache.invalidate('blogly.show_user', user_id=user_id)
+    invalidate_tag_pages(tag_ids)
+    unindex_posts([int(post_id)])
     return redirect("/users")
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 """Tag routes"""
 
-@app.route('/tags')
+@bp.route('/tags')
+@cached_page
 def view_tags():
-    """Shows list of all tags in db."""
-    tags = Tag.query.all()
-    return render_template('tags.html', tags=tags)
-
-@app.route('/tags_new')
+    """Shows list of all tags in db, optionally most used first."""
+    sort = request.args.get("sort")
+    if sort == "popular":
+        tags = paginate_request(Tag.query, [Tag.post_count, Tag.id], descending=True)
+    else:
+        sort = None
+        tags = paginate_request(Tag.query, [Tag.id])
+    return render_template('tags.html', tags=tags, sort=sort)
+
+@bp.route('/tags_new')
 def new_tag_form():
         """Shows the new tag form."""
-        posts = Post.query.all()
         return render_template('tags_new.html')
 
-@app.route('/tags_new', methods=["POST"])
+@bp.route('/tags_new', methods=["POST"])
 def create_tag():
     """Handle the new tag form."""
     tag_name = request.form["tag_name"]
 
     new_tag = Tag(tag_name=tag_name)
     db.session.add(new_tag)
+    bump_catalog_version()
     db.session.commit()
+    page_cache.invalidate('blogly.view_tags')
 
     return redirect("/tags")
 
-@app.route('/tags/<tag_id>')
+@bp.route('/tags/<tag_id>')
+@cached_page
 def show_tag_details(tag_id):
     """Show corresponding posts to a single tag."""
     tag = Tag.query.get_or_404(tag_id)
-    return render_template('tag_details.html', tag=tag)
+    posts = paginate_request(post_summaries().join(PostTag).filter(PostTag.tag_id == tag.id),
+                             [Post.created_at, Post.id], descending=True)
+    return render_template('tag_details.html', tag=tag, posts=posts)
 
-@app.route('/tags/<tag_id>/edit')
+@bp.route('/tags/<tag_id>/edit')
 def edit_tag(tag_id):
     """Show the edit tag form."""
     tag = Tag.query.get_or_404(tag_id)
-    posts = Post.query.all()
-    return render_template('edit_tag.html', tag=tag, posts=posts)
+    posts = db.session.query(Post.id, Post.title).order_by(Post.id).all()
+    selected_post_ids = {post_id for (post_id,) in
+                         db.session.query(PostTag.post_id).filter_by(tag_id=tag.id)}
+    return render_template('edit_tag.html', tag=tag, posts=posts,
+                           selected_post_ids=selected_post_ids)
 
-@app.route('/tags/<tag_id>/edit', methods=["POST"])
+@bp.route('/tags/<tag_id>/edit', methods=["POST"])
 def handle_edit_tag(tag_id):
     """Handle the edit tag form."""
     tag = Tag.query.get_or_404(tag_id)
     tag.tag_name = request.form["tag_name"]
     post_ids = [int(num) for num in request.form.getlist("posts")]
-    tag.posts = Post.query.filter(Post.id.in_(post_ids)).all()
+    added, removed = set_tag_posts(tag.id, post_ids)
+    bump_tag_posts([tag.id], len(added) - len(removed))
+    bump_catalog_version()
 
     db.session.add(tag)
     db.session.commit()
+    invalidate_tag_pages([tag_id])
     return redirect ("/tags")
 
-@app.route('/tags/<tag_id>/delete', methods=["POST"])
+@bp.route('/tags/<tag_id>/delete', methods=["POST"])
 def handle_delete_tag(tag_id):
-    """Deletes the tag."""
-    tag = Tag.query.get_or_404(tag_id)
-    tag.name = request.form['name']
-    post_ids = [int(num) for num in request.form.getlist("posts")]
-    tag.posts = Post.query.filter(Post.id.in_(post_ids)).all()
-
-    db.session.delete(tag)
+    """Deletes the tag; the database cascades to its post tags."""
+    if db.session.execute(delete(Tag).where(Tag.id == tag_id)).rowcount == 0:
+        abort(404)
+    bump_catalog_version()
     db.session.commit()
+    invalidate_tag_pages([tag_id])
+
+    return redirect("/tags")
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+"""Search routes"""
 
-    return redirect("/tags")
\ No newline at end of file
+@bp.route('/search')
+def search():
+    """Show posts matching a full-text query."""
+    results = search_from_request()
+    return render_template('search.html', results=results)
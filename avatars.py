@@ -0,0 +1,194 @@
+"""Local, content-addressed avatar store.
+
+Uploaded images are kept once under AVATAR_DIR, named by the SHA-256 of
+their bytes, and cut to fixed-size square thumbnails when uploaded (or on
+first fetch if a thumbnail is missing). Users without an upload get an
+initials avatar, drawn in memory and never written to disk, so requests
+for made-up initials cannot fill it. Either way the key in the URL fully
+determines the image, so /avatars responses are immutable and browsers
+can cache them for a year.
+"""
+
+import functools
+import hashlib
+import io
+import os
+import re
+import tempfile
+import zlib
+
+from flask import Blueprint, current_app, abort, send_file, url_for
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from models import default_image_url
+
+avatars = Blueprint("avatars", __name__, url_prefix="/avatars")
+
+SIZES = {"small": 48, "large": 160}
+THUMBNAIL_FORMAT = "WEBP"
+ONE_YEAR = 365 * 24 * 60 * 60
+INITIALS_CACHE_SIZE = 1024
+
+PALETTE = ("#1abc9c", "#2e86de", "#8e44ad", "#e67e22", "#c0392b", "#16a085", "#7f8c8d")
+
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+# i-<up to two initials>-<index into PALETTE>; see initials_key().
+INITIALS_RE = re.compile(rf"i-([^\W_]{{0,2}})-([0-{len(PALETTE) - 1}])")
+
+
+class InvalidAvatar(ValueError):
+    """The upload is not an image Pillow can read."""
+
+
+def initials_key(first_name, last_name):
+    """Key of the generated avatar for a name: its initials and a colour."""
+
+    initials = "".join(name[:1] for name in (first_name, last_name) if name[:1].isalnum())
+    colour = zlib.crc32(f"{first_name} {last_name}".encode()) % len(PALETTE)
+    return f"i-{initials.upper()}-{colour}"
+
+
+def render_initials(initials, colour, px):
+    image = Image.new("RGB", (px, px), PALETTE[colour])
+    font = ImageFont.load_default(size=px * 2 // 5)
+    ImageDraw.Draw(image).text((px / 2, px / 2), initials, fill="white", font=font, anchor="mm")
+    return image
+
+
+@functools.lru_cache(maxsize=INITIALS_CACHE_SIZE)
+def initials_thumbnail(initials, colour, size):
+    """WebP bytes of an initials avatar, kept in a bounded in-process cache."""
+
+    buffer = io.BytesIO()
+    render_initials(initials, colour, SIZES[size]).save(buffer, THUMBNAIL_FORMAT, quality=80)
+    return buffer.getvalue()
+
+
+def _write_atomically(path, write):
+    """Write a file under a temporary name and move it into place.
+
+    Concurrent workers making the same thumbnail each write their own
+    temporary file, and readers never see a partial one.
+    """
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class AvatarStore:
+    """Originals and thumbnails in a local directory, keyed by content."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def original_path(self, digest):
+        return os.path.join(self.root, "originals", digest[:2], digest)
+
+    def thumbnail_path(self, key, size):
+        return os.path.join(self.root, size, key[:2], f"{key}.{THUMBNAIL_FORMAT.lower()}")
+
+    def put(self, data):
+        """Store an uploaded image and its thumbnails. Returns its digest."""
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+        except (OSError, SyntaxError, Image.DecompressionBombError) as exc:
+            raise InvalidAvatar(str(exc)) from exc
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.original_path(digest)
+        if not os.path.exists(path):
+            _write_atomically(path, lambda f: f.write(data))
+        for size in SIZES:
+            self.thumbnail(digest, size)
+        return digest
+
+    def thumbnail(self, key, size):
+        """Return the path of digest key's thumbnail at size, making it if needed.
+
+        Raises FileNotFoundError for a digest that was never uploaded.
+        """
+
+        path = self.thumbnail_path(key, size)
+        if os.path.exists(path):
+            return path
+
+        px = SIZES[size]
+        with Image.open(self.original_path(key)) as original:
+            # Lets JPEG decode at a fraction of full size.
+            original.draft("RGB", (px * 2, px * 2))
+            image = ImageOps.fit(ImageOps.exif_transpose(original).convert("RGB"),
+                                 (px, px), Image.LANCZOS)
+        _write_atomically(path, lambda f: image.save(f, THUMBNAIL_FORMAT, quality=80))
+        return path
+
+
+def avatar_store():
+    return AvatarStore(current_app.config["AVATAR_DIR"])
+
+
+def avatar_url(user, size="small"):
+    """URL of user's avatar thumbnail at size.
+
+    A custom external image_url is passed through as is, since it cannot
+    be fetched without network access.
+    """
+
+    if user.avatar:
+        key = user.avatar
+    elif user.image_url and user.image_url != default_image_url:
+        return user.image_url
+    else:
+        key = initials_key(user.first_name, user.last_name)
+    return url_for("avatars.thumbnail", size=size, key=key)
+
+
+def save_upload(upload):
+    """Store a werkzeug FileStorage from a form; None when no file was chosen."""
+
+    if upload is None or not upload.filename:
+        return None
+    return avatar_store().put(upload.read())
+
+
+@avatars.route("/<size>/<key>.webp")
+def thumbnail(size, key):
+    """Serve a thumbnail; its URL never changes content, so cache it forever."""
+
+    if size not in SIZES:
+        abort(404)
+    initials = INITIALS_RE.fullmatch(key)
+    if initials:
+        data = initials_thumbnail(initials[1], int(initials[2]), size)
+        response = send_file(io.BytesIO(data), mimetype="image/webp", max_age=ONE_YEAR,
+                             conditional=True, etag=f"{size}-{key}")
+    elif DIGEST_RE.fullmatch(key):
+        try:
+            path = avatar_store().thumbnail(key, size)
+        except FileNotFoundError:
+            abort(404)
+        response = send_file(path, mimetype="image/webp", max_age=ONE_YEAR, conditional=True)
+    else:
+        abort(404)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_avatars(app):
+    """Default AVATAR_DIR to the instance folder and expose avatar_url to templates."""
+
+    app.config.setdefault("AVATAR_DIR", None)
+    if not app.config["AVATAR_DIR"]:
+        app.config["AVATAR_DIR"] = os.path.join(app.instance_path, "avatars")
+    app.add_template_global(avatar_url)
+    app.register_blueprint(avatars)
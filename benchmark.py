@@ -0,0 +1,475 @@
+"""Synthetic data generator and load-test driver: `flask bench seed|run`.
+
+seed builds a reproducible dataset through the bulk importer. run drives
+a weighted mix of reads and writes across every route through the test
+client, then reports throughput, latency percentiles and SQL statements
+per route. A saved baseline can be compared against later runs so that
+regressions fail the command. explain calls each route once and fails
+if PostgreSQL would answer any of its queries by reading a whole table,
+whether as a sequential scan or as a walk over an entire index.
+"""
+
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, func, select, text
+from sqlalchemy.engine import Engine
+
+from models import db, User, Post, Tag
+from bulk import import_records, DEFAULT_BATCH_SIZE
+from page_cache import page_cache
+
+bench_cli = AppGroup("bench", help="Benchmark and load-test commands for Blogly.")
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+         "tempor incididunt ut labore et dolore magna aliqua flask python postgres "
+         "garden travel cooking music coffee river mountain city winter summer").split()
+FIRST_NAMES = ("Ada Alan Grace Linus Guido Barbara Ken Dennis Margaret Edsger "
+               "Frances Donald Radia John Katherine Tim").split()
+LAST_NAMES = ("Lovelace Turing Hopper Torvalds Rossum Liskov Thompson Ritchie "
+              "Hamilton Dijkstra Allen Knuth Perlman McCarthy Johnson Berners-Lee").split()
+
+DEFAULT_TOLERANCE = 0.25
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+"""Data generator"""
+
+def _sentence(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def generate_users(rng, count, first_id):
+    for n in range(count):
+        yield {"id": first_id + n,
+               "first_name": rng.choice(FIRST_NAMES),
+               "last_name": f"{rng.choice(LAST_NAMES)}{n}"}
+
+
+def generate_posts(rng, count, user_ids, tag_names, max_tags=3):
+    start = datetime(2020, 1, 1)
+    for n in range(count):
+        yield {"title": _sentence(rng, 2, 6).capitalize(),
+               "content": _sentence(rng, 20, 200),
+               "created_at": start + timedelta(minutes=n * 7 + rng.randint(0, 6)),
+               "user_id": rng.randrange(user_ids.start, user_ids.stop),
+               "tags": rng.sample(tag_names, rng.randint(0, min(max_tags, len(tag_names))))}
+
+
+def seed_database(users, posts, tags, seed=0, batch_size=DEFAULT_BATCH_SIZE):
+    """Add a reproducible synthetic dataset. Returns (user ids, tag names)."""
+
+    rng = random.Random(seed)
+    first_id = (db.session.scalar(select(func.max(User.id))) or 0) + 1
+    user_ids = range(first_id, first_id + users)
+    tag_names = [f"tag-{seed}-{n}" for n in range(tags)]
+
+    import_records(User, generate_users(rng, users, first_id), batch_size)
+    import_records(Tag, ({"tag_name": name} for name in tag_names), batch_size)
+    if users:
+        import_records(Post, generate_posts(rng, posts, user_ids, tag_names), batch_size)
+    return user_ids, tag_names
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+"""Workload driver"""
+
+class Pools:
+    """Ids the workload picks from, kept current as it creates and deletes."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.users = list(db.session.scalars(select(User.id)))
+        self.posts = list(db.session.scalars(select(Post.id)))
+        self.tags = list(db.session.scalars(select(Tag.id)))
+        self.created_tags = []
+        self.serial = 0
+
+    def pick(self, name):
+        pool = getattr(self, name)
+        return self.rng.choice(pool) if pool else 0
+
+    def take(self, name):
+        pool = getattr(self, name)
+        if not pool:
+            return 0
+        return pool.pop(self.rng.randrange(len(pool)))
+
+    def unique(self, prefix):
+        self.serial += 1
+        return f"{prefix}-{self.serial}-{self.rng.randrange(10**9)}"
+
+
+def _user_form(pools):
+    return {"first_name": pools.rng.choice(FIRST_NAMES),
+            "last_name": pools.unique("Bench"),
+            "image_url": ""}
+
+
+def _post_form(pools):
+    return {"post_title": _sentence(pools.rng, 2, 6),
+            "post_content": _sentence(pools.rng, 20, 200),
+            "tags": [pools.pick("tags") for _ in range(pools.rng.randint(0, 3))]}
+
+
+def _create_tag(client, pools):
+    name = pools.unique("bench-tag")
+    response = client.post("/tags_new", data={"tag_name": name})
+    tag_id = db.session.scalar(select(Tag.id).where(Tag.tag_name == name))
+    if tag_id:
+        pools.tags.append(tag_id)
+        pools.created_tags.append(tag_id)
+    return response
+
+
+def _edit_tag(client, pools):
+    tag_id = pools.pick("created_tags")
+    posts = [pools.pick("posts") for _ in range(pools.rng.randint(0, 5))]
+    return client.post(f"/tags/{tag_id}/edit",
+                       data={"tag_name": pools.unique("bench-tag"), "posts": posts})
+
+
+def _delete_tag(client, pools):
+    tag_id = pools.take("created_tags")
+    if tag_id in pools.tags:
+        pools.tags.remove(tag_id)
+    return client.post(f"/tags/{tag_id}/delete")
+
+
+# (name, weight, fn(client, pools) -> response). Reads dominate, as in
+# production; every route in app.py appears at least once.
+WORKLOAD = [
+    ("root", 2, lambda c, p: c.get("/")),
+    ("list_users", 10, lambda c, p: c.get("/users")),
+    ("list_users_popular", 2, lambda c, p: c.get("/users?sort=popular")),
+    ("show_user", 12, lambda c, p: c.get(f"/{p.pick('users')}")),
+    ("new_user_form", 1, lambda c, p: c.get("/new_user")),
+    ("create_user", 2, lambda c, p: c.post("/new_user", data=_user_form(p))),
+    ("edit_user_form", 1, lambda c, p: c.get(f"/users/{p.pick('users')}/edit")),
+    ("handle_edit_user_form", 1,
+     lambda c, p: c.post(f"/users/{p.pick('users')}/edit", data=_user_form(p))),
+    ("handle_delete_user", 0.2, lambda c, p: c.post(f"/users/{p.take('users')}/delete")),
+    ("user_post_form", 2, lambda c, p: c.get(f"/users/{p.pick('users')}/posts_new")),
+    ("handle_new_post", 4,
+     lambda c, p: c.post(f"/users/{p.pick('users')}/posts_new", data=_post_form(p))),
+    ("post_details", 20, lambda c, p: c.get(f"/posts/{p.pick('posts')}")),
+    ("edit_post", 2, lambda c, p: c.get(f"/posts/{p.pick('posts')}/edit")),
+    ("hanlde_edit_post", 2,
+     lambda c, p: c.post(f"/posts/{p.pick('posts')}/edit", data=_post_form(p))),
+    ("delete_post", 0.5, lambda c, p: c.post(f"/posts/{p.take('posts')}/delete")),
+    ("view_tags", 8, lambda c, p: c.get("/tags")),
+    ("view_tags_popular", 2, lambda c, p: c.get("/tags?sort=popular")),
+    ("new_tag_form", 1, lambda c, p: c.get("/tags_new")),
+    ("create_tag", 1, _create_tag),
+    ("show_tag_details", 10, lambda c, p: c.get(f"/tags/{p.pick('tags')}")),
+    ("edit_tag", 1, lambda c, p: c.get(f"/tags/{p.pick('tags')}/edit")),
+    ("handle_edit_tag", 0.5, _edit_tag),
+    ("handle_delete_tag", 0.2, _delete_tag),
+    ("bulk_tag_posts", 0.5,
+     lambda c, p: c.post(f"/api/tags/{p.pick('created_tags')}/posts",
+                         json={"add": [p.pick("posts") for _ in range(10)]})),
+    ("search", 4, lambda c, p: c.get(f"/search?q={p.rng.choice(WORDS)}")),
+    ("api_search", 2, lambda c, p: c.get(f"/api/search?q={p.rng.choice(WORDS)}")),
+    ("metrics", 0.2, lambda c, p: c.get("/metrics")),
+    ("api.get_post", 2, lambda c, p: c.get(f"/api/posts/{p.pick('posts')}")),
+    ("api.list_user_posts", 1, lambda c, p: c.get(f"/api/users/{p.pick('users')}/posts")),
+    ("api.list_tag_posts", 0.5,
+     lambda c, p: c.get(f"/api/tags/{p.pick('tags')}/posts?format=json")),
+]
+
+
+class StatementCounter:
+    """Counts SQL statements executed while active."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self)
+
+
+class StatementRecorder:
+    """Records the SQL statements, with their parameters, executed while active."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def run_workload(requests, seed=0, workload=WORKLOAD):
+    """Issue requests weighted-random calls and return a report dict."""
+
+    rng = random.Random(seed)
+    pools = Pools(rng)
+    names = [name for name, _, _ in workload]
+    weights = [weight for _, weight, _ in workload]
+    calls = {name: fn for name, _, fn in workload}
+    samples = {name: {"latency": [], "queries": [], "errors": 0} for name in names}
+
+    client = current_app.test_client()
+    started = time.perf_counter()
+    for name in rng.choices(names, weights, k=requests):
+        with StatementCounter() as counter:
+            t0 = time.perf_counter()
+            response = calls[name](client, pools)
+            elapsed = time.perf_counter() - t0
+        db.session.remove()
+        sample = samples[name]
+        sample["latency"].append(elapsed)
+        sample["queries"].append(counter.count)
+        if response.status_code >= 500:
+            sample["errors"] += 1
+    wall = time.perf_counter() - started
+
+    routes = {}
+    for name, sample in samples.items():
+        latency = sorted(sample["latency"])
+        if not latency:
+            continue
+        routes[name] = {
+            "requests": len(latency),
+            "errors": sample["errors"],
+            "p50_ms": percentile(latency, 50) * 1000,
+            "p95_ms": percentile(latency, 95) * 1000,
+            "p99_ms": percentile(latency, 99) * 1000,
+            "mean_queries": sum(sample["queries"]) / len(latency),
+            "max_queries": max(sample["queries"]),
+        }
+    return {"requests": requests,
+            "seconds": wall,
+            "throughput_rps": requests / wall if wall else 0.0,
+            "routes": routes}
+
+
+def compare_reports(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of human-readable regressions of report vs baseline.
+
+    A route regresses when its p95 latency grows by more than tolerance,
+    when it runs more SQL statements than its baseline maximum, or when it
+    starts returning server errors.
+    """
+
+    problems = []
+    for name, base in baseline.get("routes", {}).items():
+        current = report["routes"].get(name)
+        if current is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {current['p95_ms']:.2f}ms > "
+                            f"baseline {base['p95_ms']:.2f}ms +{tolerance:.0%}")
+        if current["max_queries"] > base["max_queries"]:
+            problems.append(f"{name}: {current['max_queries']} queries > "
+                            f"baseline {base['max_queries']}")
+        if current["errors"] > base.get("errors", 0):
+            problems.append(f"{name}: {current['errors']} server errors")
+    base_rps = baseline.get("throughput_rps")
+    if base_rps and report["throughput_rps"] < base_rps / (1 + tolerance):
+        problems.append(f"throughput {report['throughput_rps']:.1f} req/s < "
+                        f"baseline {base_rps:.1f} req/s -{tolerance:.0%}")
+    return problems
+
+
+def format_report(report):
+    lines = [f"{report['requests']} requests in {report['seconds']:.2f}s "
+             f"({report['throughput_rps']:.1f} req/s)",
+             f"{'route':<24}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+             f"{'queries':>9}{'max':>5}{'5xx':>5}"]
+    for name, r in sorted(report["routes"].items()):
+        lines.append(f"{name:<24}{r['requests']:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+                     f"{r['p99_ms']:>10.2f}{r['mean_queries']:>9.1f}{r['max_queries']:>5}"
+                     f"{r['errors']:>5}")
+    return "\n".join(lines)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+"""Query plans"""
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+# (route, table) pairs that read a whole table by design: the post and tag
+# forms list every tag or post to choose from.
+SEQ_SCAN_ALLOWED = {
+    ("user_post_form", "tags"),
+    ("edit_post", "tags"),
+    ("edit_tag", "posts"),
+}
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+# Nodes that read all of their input before returning a row, so a Limit
+# above them does not stop the scan below.
+BLOCKING = ("Sort", "Hash", "Aggregate", "Materialize", "SetOp", "WindowAgg")
+
+
+def explain(statement, parameters, force_indexes=True):
+    """Return PostgreSQL's plan for statement as a dict, without running it.
+
+    With force_indexes, sequential scans are disabled for the EXPLAIN, so
+    the planner only picks one when no index can answer the query at all.
+    Without it the planner uses its normal costs, which is only telling on
+    a database of realistic size.
+    """
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if force_indexes:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        return cursor.fetchone()[0][0]["Plan"]
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def full_scans(plan, limited=False):
+    """Yield (table, node type) for every node in plan that reads a whole table.
+
+    Besides Seq Scans, that is an index scan with no Index Cond that either
+    has a Filter or is not stopped early by a Limit: with sequential scans
+    disabled the planner walks a whole index instead, which costs as much.
+    An unconditioned ordered scan feeding a Limit reads only a page of rows.
+    """
+
+    node = plan["Node Type"]
+    if node == "Seq Scan":
+        yield plan["Relation Name"], node
+    elif node in INDEX_SCANS and "Index Cond" not in plan:
+        if "Filter" in plan or not limited:
+            yield plan.get("Relation Name", plan.get("Index Name")), node
+
+    if node == "Limit":
+        limited = True
+    elif node in BLOCKING:
+        limited = False
+    for child in plan.get("Plans", ()):
+        yield from full_scans(child, limited)
+
+
+def analyze():
+    """Refresh the planner's statistics after a bulk load."""
+
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+
+def explain_workload(seed=0, workload=WORKLOAD, allowed=SEQ_SCAN_ALLOWED, force_indexes=True):
+    """Call every workload route once and EXPLAIN each statement it runs.
+
+    Returns (route, table, node type, statement) for every full table or
+    index scan that is not in allowed. Needs PostgreSQL; leave the page
+    cache off so reads reach the database.
+    """
+
+    pools = Pools(random.Random(seed))
+    client = current_app.test_client()
+    problems = []
+    for name, _, fn in workload:
+        with StatementRecorder() as recorder:
+            fn(client, pools)
+        db.session.remove()
+        for statement, parameters in recorder.statements:
+            if statement.lstrip().split(None, 1)[0].upper() not in EXPLAINABLE:
+                continue
+            for table, node in full_scans(explain(statement, parameters, force_indexes)):
+                if (name, table) not in allowed:
+                    problems.append((name, table, node, statement))
+    return problems
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+"""Commands"""
+
+@bench_cli.command("seed")
+@click.option("--users", default=100_000, show_default=True)
+@click.option("--posts", default=1_000_000, show_default=True)
+@click.option("--tags", default=500, show_default=True)
+@click.option("--seed", default=0, show_default=True, help="Random seed; same seed, same data.")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+def seed_command(users, posts, tags, seed, batch_size):
+    """Add a synthetic dataset of users, posts and tags."""
+
+    seed_database(users, posts, tags, seed, batch_size)
+    click.echo(f"Seeded {users} users, {posts} posts, {tags} tags.", err=True)
+
+
+@bench_cli.command("run")
+@click.option("--requests", "count", default=2000, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option("--cache/--no-cache", default=True, help="Leave the page cache on.")
+@click.option("--save", "save_path", type=click.Path(dir_okay=False),
+              help="Write the report as a JSON baseline.")
+@click.option("--compare", "baseline_path", type=click.Path(exists=True, dir_okay=False),
+              help="Fail if this run regresses against a saved baseline.")
+@click.option("--tolerance", default=DEFAULT_TOLERANCE, show_default=True,
+              help="Allowed fractional slowdown before a route counts as regressed.")
+def run_command(count, seed, cache, save_path, baseline_path, tolerance):
+    """Drive a mixed read/write workload and report per-route latency."""
+
+    current_app.config["PAGE_CACHE_ENABLED"] = cache
+    page_cache.clear()
+    report = run_workload(count, seed)
+    click.echo(format_report(report))
+
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if baseline_path:
+        with open(baseline_path) as f:
+            problems = compare_reports(report, json.load(f), tolerance)
+        if problems:
+            raise click.ClickException("regressions:\n  " + "\n  ".join(problems))
+        click.echo("No regressions against baseline.")
+
+
+@bench_cli.command("explain")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--analyze/--no-analyze", "run_analyze", default=True,
+              help="Run ANALYZE first so the planner sees the current data.")
+@click.option("--force-indexes/--normal-planner", default=True,
+              help="Disable sequential scans while planning, or plan as in production "
+                   "(use that on a database seeded at full size).")
+def explain_command(seed, run_analyze, force_indexes):
+    """Fail if any route's queries read a whole table or index."""
+
+    if db.session.get_bind().dialect.name != "postgresql":
+        raise click.ClickException("explain needs a PostgreSQL database")
+    if run_analyze:
+        analyze()
+    current_app.config["PAGE_CACHE_ENABLED"] = False
+    problems = explain_workload(seed, force_indexes=force_indexes)
+    for name, table, node, statement in problems:
+        click.echo(f"{name}: {node} over all of {table}\n    {' '.join(statement.split())}")
+    if problems:
+        raise click.ClickException(f"{len(problems)} full scans")
+    click.echo("No full scans.")
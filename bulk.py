@@ -0,0 +1,327 @@
+"""Bulk import/export commands: `flask blogly import|export`."""
+
+import csv
+import io
+import json
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, select, text, update
+
+from models import db, User, Post, Tag, PostTag, make_excerpt
+from counters import reconcile_post_counts
+from catalog import bump_catalog_version
+
+blogly_cli = AppGroup("blogly", help="Bulk data commands for Blogly.")
+
+MODELS = {"users": User, "posts": Post, "tags": Tag, "post_tags": PostTag}
+FORMATS = ("jsonl", "csv")
+DEFAULT_BATCH_SIZE = 5000
+
+
+def batched(iterable, size):
+    """Yield lists of up to size items from iterable."""
+
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def read_records(stream, fmt):
+    """Yield one dict per JSONL line or CSV row."""
+
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _coerce(column, value):
+    python_type = column.type.python_type
+    if isinstance(value, str):
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is int:
+            return int(value)
+    return value
+
+
+def prepare_row(table, record):
+    """Build an insert row for table from a raw record, applying defaults.
+
+    Defaults are filled in here rather than left to SQLAlchemy so that
+    rows sent through COPY get them too. An autoincrement primary key is
+    only included when the record supplies it.
+    """
+
+    row = {}
+    for column in table.columns:
+        value = record.get(column.key)
+        if value is None or value == "":
+            if column.default is not None:
+                default = column.default
+                value = default.arg(None) if default.is_callable else default.arg
+            elif column.primary_key and column.autoincrement in (True, "auto"):
+                continue
+            else:
+                value = None
+        row[column.key] = _coerce(column, value)
+    return row
+
+
+def parse_tag_names(value):
+    """Tags may be given as a JSON list or a ';'-separated CSV field."""
+
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(";")
+    return [name.strip() for name in value if name.strip()]
+
+
+def _is_postgres():
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def copy_rows(table, columns, rows):
+    """Load rows with PostgreSQL COPY, which skips per-row INSERT parsing."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buffer)
+
+
+def insert_rows(table, rows, use_copy=False, return_ids=False):
+    """Insert rows in as few statements as possible.
+
+    Rows are grouped by their column set so each group is one executemany
+    (or one COPY). With return_ids, the ids of the inserted rows are
+    returned in input order.
+    """
+
+    groups = {}
+    for index, row in enumerate(rows):
+        groups.setdefault(tuple(row), []).append(index)
+
+    ids = [None] * len(rows)
+    for columns, indexes in groups.items():
+        group = [rows[i] for i in indexes]
+        if return_ids and "id" not in columns:
+            stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            new_ids = db.session.scalars(stmt, group).all()
+        else:
+            if use_copy:
+                copy_rows(table, columns, group)
+            else:
+                db.session.execute(insert(table), group)
+            new_ids = [row.get("id") for row in group]
+        for index, new_id in zip(indexes, new_ids):
+            ids[index] = new_id
+    return ids
+
+
+def resolve_tag_names(names, use_copy=False):
+    """Return {tag_name: id}, creating any tags that do not exist yet."""
+
+    names = set(names)
+    if not names:
+        return {}
+    tag_ids = dict(db.session.execute(
+        select(Tag.tag_name, Tag.id).where(Tag.tag_name.in_(names))).all())
+
+    missing = sorted(names - tag_ids.keys())
+    if missing:
+        rows = [prepare_row(Tag.__table__, {"tag_name": name}) for name in missing]
+        new_ids = insert_rows(Tag.__table__, rows, return_ids=True)
+        tag_ids.update(zip(missing, new_ids))
+    return tag_ids
+
+
+def sync_sequence(table):
+    """Move a PostgreSQL serial past any ids that were loaded explicitly."""
+
+    if "id" not in table.c or not _is_postgres():
+        return
+    db.session.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"))
+
+
+def import_records(model, records, batch_size=DEFAULT_BATCH_SIZE, use_copy=True):
+    """Insert records into model's table, committing once per batch.
+
+    Post records may carry a "tags" list of tag names; these are resolved
+    (and created if needed) once per batch and linked through post_tags.
+    Returns the number of records imported.
+    """
+
+    table = model.__table__
+    use_copy = use_copy and _is_postgres()
+    count = 0
+
+    for batch in batched(records, batch_size):
+        rows = [prepare_row(table, record) for record in batch]
+        if model is Post:
+            for row in rows:
+                if not row.get("excerpt"):
+                    row["excerpt"] = make_excerpt(row["content"])
+            tag_names = [parse_tag_names(record.get("tags")) for record in batch]
+            post_ids = insert_rows(table, rows, use_copy, return_ids=any(tag_names))
+            tag_ids = resolve_tag_names(name for names in tag_names for name in names)
+            links = [{"post_id": post_id, "tag_id": tag_ids[name]}
+                     for post_id, names in zip(post_ids, tag_names)
+                     for name in dict.fromkeys(names)]
+            if links:
+                insert_rows(PostTag.__table__, links, use_copy)
+        else:
+            insert_rows(table, rows, use_copy)
+        db.session.commit()
+        count += len(rows)
+
+    for touched in (table, Tag.__table__):
+        sync_sequence(touched)
+    if model in (Post, Tag):
+        # Post imports may have created tags by name.
+        bump_catalog_version()
+    db.session.commit()
+    if model in (Post, PostTag):
+        reconcile_post_counts()
+    return count
+
+
+def refresh_excerpts(batch_size=DEFAULT_BATCH_SIZE):
+    """Recompute every post's stored excerpt, one id range at a time."""
+
+    last_id = 0
+    count = 0
+    while True:
+        rows = db.session.execute(select(Post.id, Post.content)
+                                  .where(Post.id > last_id)
+                                  .order_by(Post.id)
+                                  .limit(batch_size)).all()
+        if not rows:
+            return count
+        db.session.execute(update(Post), [{"id": post_id, "excerpt": make_excerpt(content)}
+                                          for post_id, content in rows])
+        db.session.commit()
+        last_id = rows[-1].id
+        count += len(rows)
+
+
+def export_rows(model, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield every row of model's table as a mapping.
+
+    Rows come from a server-side cursor in batch_size chunks, so memory
+    use does not grow with the size of the table.
+    """
+
+    table = model.__table__
+    stmt = (select(table)
+            .order_by(*table.primary_key.columns)
+            .execution_options(yield_per=batch_size))
+    for row in db.session.execute(stmt):
+        yield row._mapping
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"cannot serialize {type(value).__name__}")
+
+
+def write_records(stream, model, rows, fmt):
+    """Write rows to stream as JSONL or CSV. Returns the number written."""
+
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(stream, fieldnames=[c.key for c in model.__table__.columns])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: (v.isoformat() if isinstance(v, datetime) else v)
+                             for k, v in row.items()})
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(dict(row), default=_json_default))
+            stream.write("\n")
+            count += 1
+    return count
+
+
+def _guess_format(path, fmt):
+    if fmt:
+        return fmt
+    return "csv" if path.endswith(".csv") else "jsonl"
+
+
+@contextmanager
+def _open(path, mode):
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+        return
+    with open(path, mode, newline="", encoding="utf-8") as stream:
+        yield stream
+
+
+@blogly_cli.command("import")
+@click.argument("model", type=click.Choice(sorted(MODELS)))
+@click.argument("path", default="-")
+@click.option("--format", "fmt", type=click.Choice(FORMATS),
+              help="Input format; guessed from the file extension by default.")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option("--copy/--no-copy", "use_copy", default=True,
+              help="Use PostgreSQL COPY when the database supports it.")
+def import_command(model, path, fmt, batch_size, use_copy):
+    """Import MODEL rows from a JSONL or CSV file (or stdin)."""
+
+    with _open(path, "r") as stream:
+        records = read_records(stream, _guess_format(path, fmt))
+        count = import_records(MODELS[model], records, batch_size, use_copy)
+    click.echo(f"Imported {count} {model}.", err=True)
+
+
+@blogly_cli.command("export")
+@click.argument("model", type=click.Choice(sorted(MODELS)))
+@click.argument("path", default="-")
+@click.option("--format", "fmt", type=click.Choice(FORMATS),
+              help="Output format; guessed from the file extension by default.")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+def export_command(model, path, fmt, batch_size):
+    """Export MODEL rows to a JSONL or CSV file (or stdout)."""
+
+    with _open(path, "w") as stream:
+        count = write_records(stream, MODELS[model],
+                              export_rows(MODELS[model], batch_size),
+                              _guess_format(path, fmt))
+    click.echo(f"Exported {count} {model}.", err=True)
+
+
+@blogly_cli.command("refresh-excerpts")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+def refresh_excerpts_command(batch_size):
+    """Recompute the stored excerpt of every post."""
+
+    count = refresh_excerpts(batch_size)
+    click.echo(f"Refreshed {count} excerpts.", err=True)
+
+
+@blogly_cli.command("recount")
+def recount_command():
+    """Recompute the post counts stored on users and tags."""
+
+    reconcile_post_counts()
+    click.echo("Recounted posts for all users and tags.", err=True)
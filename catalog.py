@@ -0,0 +1,85 @@
+"""Process-local cache of the tag catalog.
+
+Tags are few and rarely change, but every post form lists all of them.
+Each process keeps the catalog in memory and checks it against the single
+catalog_version row before each use, which is one primary-key lookup
+instead of a read of the whole tags table. Every write that adds, renames
+or deletes tags calls bump_catalog_version() inside the write's own
+transaction, so the new version commits together with the tag change, and
+all processes reload on their next use and never serve a stale catalog.
+"""
+
+import threading
+from collections import namedtuple
+
+from sqlalchemy import DDL, event, insert, select, update
+
+from models import db, Tag, CatalogVersion
+
+CATALOG_ROW = 1
+
+CatalogTag = namedtuple("CatalogTag", "id tag_name")
+
+event.listen(CatalogVersion.__table__, "after_create",
+             DDL(f"INSERT INTO catalog_version (id, version) VALUES ({CATALOG_ROW}, 0)"))
+
+
+def catalog_version():
+    return db.session.scalar(select(CatalogVersion.version)
+                             .where(CatalogVersion.id == CATALOG_ROW)) or 0
+
+
+def bump_catalog_version():
+    """Mark the tag catalog changed. Callers commit."""
+
+    result = db.session.execute(update(CatalogVersion)
+                                .where(CatalogVersion.id == CATALOG_ROW)
+                                .values(version=CatalogVersion.version + 1)
+                                .execution_options(synchronize_session=False))
+    if result.rowcount == 0:
+        db.session.execute(insert(CatalogVersion).values(id=CATALOG_ROW, version=1))
+
+
+class TagCatalog:
+    """Every tag as an id -> name map and a list sorted by name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def _current(self):
+        # Read the version before the tags, so a snapshot is never older
+        # than the version it is stored under.
+        version = catalog_version()
+        snapshot = self._snapshot
+        if snapshot[0] != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot[0] != version:
+                    tags = [CatalogTag(*row) for row in db.session.execute(
+                        select(Tag.id, Tag.tag_name).order_by(Tag.tag_name, Tag.id))]
+                    snapshot = (version, {tag.id: tag.tag_name for tag in tags}, tags)
+                    self._snapshot = snapshot
+        return snapshot
+
+    def tags(self):
+        return self._current()[2]
+
+    def names(self):
+        return self._current()[1]
+
+    def existing(self, tag_ids):
+        """Return the ids in tag_ids that name a tag, in order and without repeats."""
+
+        names = self.names()
+        return [tag_id for tag_id in dict.fromkeys(tag_ids) if tag_id in names]
+
+    def clear(self):
+        self._snapshot = (None, {}, [])
+
+
+tag_catalog = TagCatalog()
+
+# A freshly created database starts again at version 0.
+event.listen(CatalogVersion.__table__, "after_create",
+             lambda *args, **kwargs: tag_catalog.clear())
@@ -0,0 +1,70 @@
+"""Runtime profiles for Blogly, selected by name in create_app()."""
+
+import os
+
+
+def replica_binds(variable):
+    """A "replica" bind when the environment variable names a read replica."""
+
+    url = os.environ.get(variable)
+    return {"replica": url} if url else {}
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SLOW_QUERY_THRESHOLD_MS = 100
+    PAGE_CACHE_ENABLED = True
+    DEBUG_TOOLBAR = False
+    # Reads stay on the primary this long after a browser's own write;
+    # keep it above the replica's usual lag.
+    READ_YOUR_WRITES_SECONDS = 5
+    # Uploaded avatars; defaults to <instance folder>/avatars.
+    AVATAR_DIR = os.environ.get("AVATAR_DIR")
+    MAX_CONTENT_LENGTH = 5 * 1024 * 1024
+
+
+class DevConfig(Config):
+    """Local development: debug toolbar on, default local database."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgresql:///blogly_db")
+    SQLALCHEMY_BINDS = replica_binds("DATABASE_REPLICA_URL")
+    SECRET_KEY = "123"
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+
+class TestConfig(Config):
+    """Test suite: its own database, no caching between tests."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL", "postgresql:///bogly_test")
+    SQLALCHEMY_BINDS = replica_binds("TEST_REPLICA_DATABASE_URL")
+    SECRET_KEY = "test"
+    TESTING = True
+    PAGE_CACHE_ENABLED = False
+
+
+class ProdConfig(Config):
+    """Production: sized, health-checked connection pools and no debug tooling."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgresql:///blogly_db")
+    SQLALCHEMY_BINDS = replica_binds("DATABASE_REPLICA_URL")
+    SECRET_KEY = os.environ.get("SECRET_KEY")
+    SLOW_QUERY_THRESHOLD_MS = 250
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        # Recycle before typical server/proxy idle timeouts cut connections.
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": True,
+    }
+
+
+PROFILES = {
+    "dev": DevConfig,
+    "test": TestConfig,
+    "prod": ProdConfig,
+}
@@ -0,0 +1,70 @@
+"""Incremental maintenance of the denormalized post counts.
+
+users.post_count and tags.post_count let /users and /tags show and sort
+by popularity without counting posts on every view. The write routes
+adjust them with relative UPDATEs in the same transaction as the change
+itself; reconcile_post_counts() recomputes them all from scratch.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import func, select, update
+
+from models import db, User, Post, Tag, PostTag
+
+
+def bump_user_posts(user_id, delta):
+    """Add delta to one user's post count."""
+
+    if delta:
+        db.session.execute(update(User)
+                           .where(User.id == user_id)
+                           .values(post_count=User.post_count + delta)
+                           .execution_options(synchronize_session=False))
+
+
+def bump_tag_posts(tag_ids, delta):
+    """Add delta to the post count of every tag in tag_ids."""
+
+    tag_ids = set(tag_ids)
+    if tag_ids and delta:
+        db.session.execute(update(Tag)
+                           .where(Tag.id.in_(tag_ids))
+                           .values(post_count=Tag.post_count + delta)
+                           .execution_options(synchronize_session=False))
+
+
+def bump_tags_by(deltas):
+    """Apply {tag_id: delta}, with one UPDATE per distinct delta."""
+
+    by_delta = defaultdict(set)
+    for tag_id, delta in deltas.items():
+        by_delta[delta].add(tag_id)
+    for delta, tag_ids in by_delta.items():
+        bump_tag_posts(tag_ids, delta)
+
+
+def tag_link_counts_of_user(user_id):
+    """Return {tag_id: number of the user's posts carrying it}."""
+
+    return dict(db.session.execute(
+        select(PostTag.tag_id, func.count())
+        .join(Post, Post.id == PostTag.post_id)
+        .where(Post.user_id == user_id)
+        .group_by(PostTag.tag_id)).all())
+
+
+def reconcile_post_counts():
+    """Recompute every user and tag post count in two bulk UPDATEs."""
+
+    db.session.execute(update(User)
+                       .values(post_count=select(func.count(Post.id))
+                               .where(Post.user_id == User.id)
+                               .scalar_subquery())
+                       .execution_options(synchronize_session=False))
+    db.session.execute(update(Tag)
+                       .values(post_count=select(func.count(PostTag.post_id))
+                               .where(PostTag.tag_id == Tag.id)
+                               .scalar_subquery())
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
@@ -0,0 +1,162 @@
+"""Per-request SQL and latency instrumentation for Blogly."""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import (g, request, has_request_context, request_started,
+                   request_finished, before_render_template, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_log = logging.getLogger("blogly.slow_query")
+_slow_query_threshold = None
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    """A Prometheus-style cumulative histogram, labelled by endpoint."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def snapshot(self):
+        """Return {endpoint: (bucket_counts, sum)} with non-cumulative counts."""
+
+        with self._lock:
+            return {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for endpoint, (counts, total) in sorted(self.snapshot().items()):
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                lines.append(f'{self.name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {running}')
+            lines.append(f'{self.name}_sum{{endpoint="{endpoint}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{endpoint="{endpoint}"}} {running}')
+        return "\n".join(lines)
+
+
+request_seconds = Histogram("blogly_request_seconds",
+                            "Wall time spent handling a request.", TIME_BUCKETS)
+db_seconds = Histogram("blogly_request_db_seconds",
+                       "Time spent executing SQL per request.", TIME_BUCKETS)
+render_seconds = Histogram("blogly_request_render_seconds",
+                           "Time spent rendering templates per request.", TIME_BUCKETS)
+query_count = Histogram("blogly_request_queries",
+                        "Number of SQL statements executed per request.", COUNT_BUCKETS)
+
+HISTOGRAMS = (request_seconds, db_seconds, render_seconds, query_count)
+
+
+def render_metrics():
+    """Return every histogram in Prometheus text exposition format."""
+
+    return "\n".join(h.render() for h in HISTOGRAMS) + "\n"
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.reset()
+
+
+def _stats():
+    """Return the stats dict for the current request, or None outside one."""
+
+    if not has_request_context():
+        return None
+    return g.get("_blogly_stats")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._blogly_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._blogly_query_start
+
+    stats = _stats()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db"] += elapsed
+
+    threshold = _slow_query_threshold
+    if threshold is not None and elapsed * 1000 >= threshold:
+        slow_query_log.warning("%.1fms %s %r", elapsed * 1000, statement, parameters)
+
+
+def _on_request_started(sender, **extra):
+    g._blogly_stats = {"start": time.perf_counter(), "queries": 0, "db": 0.0,
+                       "render": 0.0, "render_start": None}
+
+
+def _on_before_render(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None:
+        stats["render_start"] = time.perf_counter()
+
+
+def _on_template_rendered(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None and stats["render_start"] is not None:
+        stats["render"] += time.perf_counter() - stats["render_start"]
+        stats["render_start"] = None
+
+
+def _on_request_finished(sender, response, **extra):
+    stats = _stats()
+    if stats is None:
+        return
+    endpoint = request.endpoint or "unmatched"
+    request_seconds.observe(endpoint, time.perf_counter() - stats["start"])
+    db_seconds.observe(endpoint, stats["db"])
+    render_seconds.observe(endpoint, stats["render"])
+    query_count.observe(endpoint, stats["queries"])
+
+
+def metrics_view():
+    """Expose collected metrics for Prometheus to scrape."""
+
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+def init_metrics(app):
+    """Hook SQL and request timing into app and serve them at /metrics.
+
+    SLOW_QUERY_THRESHOLD_MS, when set, logs every statement slower than
+    that many milliseconds to the "blogly.slow_query" logger.
+    """
+
+    global _slow_query_threshold
+    _slow_query_threshold = app.config.get("SLOW_QUERY_THRESHOLD_MS")
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    request_started.connect(_on_request_started, app)
+    request_finished.connect(_on_request_finished, app)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_template_rendered, app)
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
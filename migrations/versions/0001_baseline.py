@@ -0,0 +1,65 @@
+"""Baseline schema: users, posts, tags and post_tags as first released
+
+Databases created with db.create_all() before migrations were added
+already have this schema; mark them with `flask db stamp 0001` and then
+run `flask db upgrade`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Constraint names are the ones PostgreSQL gives unnamed constraints,
+    # so later revisions can address them on either kind of database.
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('first_name', sa.Text(), nullable=False),
+        sa.Column('last_name', sa.Text(), nullable=False),
+        sa.Column('image_url', sa.Text(), nullable=False),
+    )
+
+    op.create_table(
+        'posts',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('title', sa.Text(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='posts_user_id_fkey'),
+    )
+
+    op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('tag_name', sa.Text()),
+        sa.UniqueConstraint('tag_name', name='tags_tag_name_key'),
+    )
+
+    op.create_table(
+        'post_tags',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('post_id', 'tag_id'),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], name='post_tags_post_id_fkey'),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], name='post_tags_tag_id_fkey'),
+    )
+
+
+def downgrade():
+    op.drop_table('post_tags')
+    op.drop_table('tags')
+    op.drop_table('posts')
+    op.drop_table('users')
@@ -0,0 +1,40 @@
+"""Delete a user's posts and a post's or tag's links in the database
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:05:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# Names the unnamed SQLite constraints the way PostgreSQL does, so batch
+# mode can find them.
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+FOREIGN_KEYS = [
+    ('posts', 'posts_user_id_fkey', 'users', 'user_id'),
+    ('post_tags', 'post_tags_post_id_fkey', 'posts', 'post_id'),
+    ('post_tags', 'post_tags_tag_id_fkey', 'tags', 'tag_id'),
+]
+
+
+def _recreate_foreign_keys(ondelete):
+    for table, name, referent, column in FOREIGN_KEYS:
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referent, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _recreate_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _recreate_foreign_keys(None)
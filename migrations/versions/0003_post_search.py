@@ -0,0 +1,39 @@
+"""Generated tsvector column and GIN index for post search (PostgreSQL only)
+
+Other databases search through the in-process index in search.py.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def _is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    if not _is_postgres():
+        return
+    op.execute("""ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(content, '')), 'B')
+        ) STORED""")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING GIN (search_vector)")
+
+
+def downgrade():
+    if not _is_postgres():
+        return
+    op.execute("DROP INDEX IF EXISTS ix_posts_search_vector")
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS search_vector")
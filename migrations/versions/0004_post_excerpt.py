@@ -0,0 +1,58 @@
+"""Stored excerpt on posts, backfilled from their content
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+EXCERPT_LENGTH = 200
+
+posts = sa.table('posts',
+                 sa.column('id', sa.Integer),
+                 sa.column('content', sa.Text),
+                 sa.column('excerpt', sa.Text))
+
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    # A copy of models.make_excerpt as of this revision.
+    text = " ".join((content or "").split())
+    if len(text) <= length:
+        return text
+    cut = text.rfind(" ", 0, length)
+    return text[:cut if cut > 0 else length].rstrip() + "…"
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('excerpt', sa.Text(), nullable=False, server_default=''))
+
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select(posts.c.id, posts.c.content)
+                            .where(posts.c.id > last_id)
+                            .order_by(posts.c.id)
+                            .limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        bind.execute(posts.update()
+                     .where(posts.c.id == sa.bindparam('post_id'))
+                     .values(excerpt=sa.bindparam('new_excerpt')),
+                     [{'post_id': post_id, 'new_excerpt': make_excerpt(content)}
+                      for post_id, content in rows])
+        last_id = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('excerpt')
@@ -0,0 +1,42 @@
+"""Denormalized post counts on users and tags, with their sort indexes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('post_count', sa.Integer(), nullable=False,
+                                     server_default='0'))
+    op.add_column('tags', sa.Column('post_count', sa.Integer(), nullable=False,
+                                    server_default='0'))
+
+    op.execute("""UPDATE users SET post_count =
+                  (SELECT count(posts.id) FROM posts WHERE posts.user_id = users.id)""")
+    op.execute("""UPDATE tags SET post_count =
+                  (SELECT count(post_tags.post_id) FROM post_tags WHERE post_tags.tag_id = tags.id)""")
+
+    op.create_index('ix_users_post_count_id', 'users', ['post_count', 'id'],
+                    postgresql_include=['first_name', 'last_name'])
+    op.create_index('ix_tags_post_count_id', 'tags', ['post_count', 'id'],
+                    postgresql_include=['tag_name'])
+
+
+def downgrade():
+    op.drop_index('ix_tags_post_count_id', table_name='tags')
+    op.drop_index('ix_users_post_count_id', table_name='users')
+    with op.batch_alter_table('tags') as batch_op:
+        batch_op.drop_column('post_count')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('post_count')
@@ -0,0 +1,50 @@
+"""Indexes for the post, tag and tag-name lookups the routes make
+
+- posts (user_id, created_at, id): a user's posts newest first, and the
+  users.id foreign key on delete.
+- posts (created_at, id): posts in date order across all users.
+- post_tags (tag_id, post_id): a tag's posts; the primary key leads with
+  post_id so cannot serve these.
+- tags (tag_name): a named unique index in place of the anonymous unique
+  constraint, so lookups by name have an index the models declare.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+
+
+# Databases made by db.create_all() on SQLite have an unnamed unique
+# constraint; batch mode finds it under the name PostgreSQL gives it.
+NAMING_CONVENTION = {"uq": "%(table_name)s_%(column_0_name)s_key"}
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_posts_user_id_created_at_id', 'posts',
+                    ['user_id', 'created_at', 'id'])
+    op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'])
+    op.create_index('ix_post_tags_tag_id_post_id', 'post_tags', ['tag_id', 'post_id'])
+
+    # Batch mode so SQLite, which cannot drop a constraint in place, copies the table.
+    with op.batch_alter_table('tags', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('tags_tag_name_key', type_='unique')
+        batch_op.create_index('ix_tags_tag_name', ['tag_name'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('tags') as batch_op:
+        batch_op.drop_index('ix_tags_tag_name')
+        batch_op.create_unique_constraint('tags_tag_name_key', ['tag_name'])
+
+    op.drop_index('ix_post_tags_tag_id_post_id', table_name='post_tags')
+    op.drop_index('ix_posts_created_at_id', table_name='posts')
+    op.drop_index('ix_posts_user_id_created_at_id', table_name='posts')
@@ -0,0 +1,28 @@
+"""page_versions table for invalidating cached pages in every process
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'page_versions',
+        sa.Column('group_key', sa.Text(), primary_key=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('page_versions')
@@ -0,0 +1,27 @@
+"""Cover the avatar columns in the users post-count index
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_users_post_count_id', table_name='users')
+    op.create_index('ix_users_post_count_id', 'users', ['post_count', 'id'],
+                    postgresql_include=['first_name', 'last_name', 'image_url', 'avatar'])
+
+
+def downgrade():
+    op.drop_index('ix_users_post_count_id', table_name='users')
+    op.create_index('ix_users_post_count_id', 'users', ['post_count', 'id'],
+                    postgresql_include=['first_name', 'last_name'])
@@ -1,9 +1,16 @@
 """Models for Blogly."""
 
+import os
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+EXCERPT_LENGTH = 200
 
 default_image_url = "https://img.freepik.com/free-vector/user-blue-gradient_78370-4692.jpg?w=826&t=st=1712240115~exp=1712240715~hmac=ec275943900481bfc64f790c547f043f8554bf3398e6cf2fab36de9dc3f590ce"
 
@@ -11,8 +18,43 @@ def connect_db(app):
      db.app = app
      db.init_app(app)
 
+     # A forked worker must not reuse connections opened by its parent.
+     # close=False leaves the parent's sockets alone and just starts the
+     # child with an empty pool.
+     if hasattr(os, "register_at_fork"):
+          os.register_at_fork(after_in_child=lambda: dispose_engines(app))
+
+def dispose_engines(app):
+     """Drop every pooled connection app's engines hold, without closing them."""
+
+     with app.app_context():
+          for engine in db.engines.values():
+               engine.dispose(close=False)
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    """Return a short plain-text lead-in for content, cut at a word boundary."""
+
+    text = " ".join((content or "").split())
+    if len(text) <= length:
+        return text
+    cut = text.rfind(" ", 0, length)
+    return text[:cut if cut > 0 else length].rstrip() + "\u2026"
+
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked."""
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
 class User(db.Model):
     __tablename__ = "users"
+    __table_args__ = (
+        # "Most active users": ordered by count, covering what the list shows
+        # (see user_summaries()).
+        db.Index("ix_users_post_count_id", "post_count", "id",
+                 postgresql_include=["first_name", "last_name", "image_url", "avatar"]),
+    )
 
     id = db.Column(db.Integer,
                    primary_key=True,
@@ -27,8 +69,18 @@ class User(db.Model):
     image_url = db.Column(db.Text,
                           nullable=False,
                           default=default_image_url)
+
+    # Digest of an uploaded avatar in the local store; see avatars.py.
+    avatar = db.Column(db.Text)
+
+    # Maintained by the post write routes; see counters.py.
+    post_count = db.Column(db.Integer,
+                           nullable=False,
+                           default=0,
+                           server_default="0")
     
-    posts = db.relationship("Post", backref="user", )
+    posts = db.relationship("Post", back_populates="user",
+                            cascade="all, delete-orphan", passive_deletes=True)
     
     @property
     def full_name(self):
@@ -36,8 +88,23 @@ class User(db.Model):
 
         return f"{self.first_name} {self.last_name}"
 
+def user_summaries():
+    """Query the columns the user listing shows, all in ix_users_post_count_id."""
+
+    return db.session.query(User.id,
+                            User.first_name,
+                            User.last_name,
+                            User.post_count,
+                            User.image_url,
+                            User.avatar)
+
 class Post(db.Model):
     __tablename__ = "posts"
+    __table_args__ = (
+        # A user's posts, newest first; also serves the users.id cascade.
+        db.Index("ix_posts_user_id_created_at_id", "user_id", "created_at", "id"),
+        db.Index("ix_posts_created_at_id", "created_at", "id"),
+    )
 
     id = db.Column(db.Integer,
                    primary_key=True,
@@ -46,35 +113,109 @@ class Post(db.Model):
     title = db.Column(db.Text,
                       nullable=False)
     
-    content = db.Column(db.Text,
-                        nullable=False)
+    # Only detail and edit pages need the body; list views use excerpt.
+    content = db.deferred(db.Column(db.Text,
+                                    nullable=False))
+
+    excerpt = db.Column(db.Text,
+                        nullable=False,
+                        default="",
+                        server_default="")
     
     created_at = db.Column(db.DateTime,
                            nullable=False,
                            default=datetime.now)
     
     user_id = db.Column(db.Integer, 
-                        db.ForeignKey('users.id'), 
+                        db.ForeignKey('users.id', ondelete="CASCADE"), 
                         nullable=False)
 
+    user = db.relationship("User", back_populates="posts")
+
+    tags = db.relationship("Tag", secondary="post_tags", back_populates="posts",
+                           passive_deletes=True)
+
+    @db.validates("content")
+    def update_excerpt(self, key, content):
+        """Keep the stored excerpt in step with the body."""
+
+        self.excerpt = make_excerpt(content)
+        return content
+
+def post_summaries():
+    """Query the columns post listings show, without loading post bodies."""
+
+    return (db.session.query(Post.id,
+                             Post.title,
+                             Post.created_at,
+                             Post.excerpt,
+                             Post.user_id,
+                             (User.first_name + " " + User.last_name).label("author"))
+            .join(User, Post.user_id == User.id))
+
 class PostTag(db.Model):
     """Tags on a post."""
 
     __tablename__ = "post_tags"
+    __table_args__ = (
+        # The primary key leads with post_id; Tag.posts looks up by tag_id.
+        db.Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),
+    )
 
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
-    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete="CASCADE"), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete="CASCADE"), primary_key=True)
 
 class Tag(db.Model):
     """A tag that can be added to a post."""
     __tablename__ = "tags"
+    __table_args__ = (
+        db.Index("ix_tags_post_count_id", "post_count", "id",
+                 postgresql_include=["tag_name"]),
+    )
 
     id = db.Column(db.Integer,
                    primary_key=True,
                    autoincrement=True)
     
     tag_name = db.Column(db.Text,
-                        unique=True)
+                        unique=True,
+                        index=True)
+
+    # Maintained by the post and tag write routes; see counters.py.
+    post_count = db.Column(db.Integer,
+                           nullable=False,
+                           default=0,
+                           server_default="0")
     
-    posts = db.relationship('Post', secondary="post_tags", backref="tags")
+    posts = db.relationship('Post', secondary="post_tags", back_populates="tags",
+                            passive_deletes=True)
+
+class CatalogVersion(db.Model):
+    """A single row whose version goes up whenever the tag catalog changes.
+
+    Processes compare it with their cached copy; see catalog.py.
+    """
+
+    __tablename__ = "catalog_version"
+
+    id = db.Column(db.Integer,
+                   primary_key=True)
+
+    version = db.Column(db.Integer,
+                        nullable=False,
+                        default=0)
+
+class PageVersion(db.Model):
+    """How many times one group of cached pages has been invalidated.
+
+    Every process checks its cached copy against it; see page_cache.py.
+    """
+
+    __tablename__ = "page_versions"
+
+    group_key = db.Column(db.Text,
+                          primary_key=True)
 
+    version = db.Column(db.Integer,
+                        nullable=False,
+                        default=0)
@@ -0,0 +1,229 @@
+"""Rendered-page cache with LRU eviction and ETag revalidation.
+
+Each process keeps its own pages, but invalidations are shared: every
+group of pages has a row in page_versions whose version goes up when the
+group is invalidated. A request reads its group's version before it
+renders, stores the page under that version and only serves a stored
+page whose version is still current. So one worker's write reaches every
+worker, and a page rendered from data older than the latest invalidation
+is never served. Entries also expire after PAGE_CACHE_TTL seconds.
+
+A page can instead be checked against the versions of other groups (see
+cached_page's version_groups), so that e.g. post pages follow their
+author's and tags' pages and need no version rows of their own.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import partial, wraps
+
+from flask import g, request, current_app, make_response, has_app_context, has_request_context
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, PageVersion
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 300
+
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def group_name(group):
+    """The page_versions key of a group from PageCache.group_key()."""
+
+    endpoint, view_args = group
+    return endpoint + "".join(f";{name}={value}" for name, value in view_args)
+
+
+def page_versions(groups):
+    """The current versions of groups, as a tuple in the same order."""
+
+    names = [group_name(group) for group in groups]
+    found = dict(db.session.execute(select(PageVersion.group_key, PageVersion.version)
+                                    .where(PageVersion.group_key.in_(names))).all())
+    return tuple(found.get(name, 0) for name in names)
+
+
+def bump_page_versions(groups):
+    """Invalidate groups in every process with one statement, committed on its own."""
+
+    rows = [{"group_key": name, "version": 1}
+            for name in sorted({group_name(group) for group in groups})]
+    if not rows:
+        return
+    upsert = UPSERTS[db.session.get_bind().dialect.name](PageVersion).values(rows)
+    db.session.execute(upsert.on_conflict_do_update(
+        index_elements=[PageVersion.group_key],
+        set_={"version": PageVersion.version + 1}))
+    db.session.commit()
+
+
+class PageCache:
+    """A bounded, thread-safe LRU cache of rendered page bodies.
+
+    Entries are keyed by (endpoint, view args, query string). Entries that
+    share an endpoint and view args form a group, so a write can drop every
+    page of e.g. one user's post listing with a single invalidate() call.
+    Each entry records the group version it was rendered at, and get()
+    only returns it while that is still the current version.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._bytes = 0
+
+    @staticmethod
+    def group_key(endpoint, **view_args):
+        return (endpoint, tuple(sorted((k, str(v)) for k, v in view_args.items())))
+
+    def get(self, key, version):
+        """Return (body, etag, mimetype) if key was cached at version and is fresh."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] != version or entry[4] <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[:3]
+
+    def set(self, key, body, etag, mimetype, version):
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (body, etag, mimetype, version, time.monotonic() + self.ttl)
+            self._groups.setdefault(key[0], set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, endpoint, **view_args):
+        """Drop every cached page for endpoint rendered with view_args.
+
+        Local copies go at once. In a request the shared version is bumped
+        once the view returns, together with the request's other
+        invalidations; outside one it is bumped right away. Nothing is
+        written while PAGE_CACHE_ENABLED is off.
+        """
+
+        group = self.group_key(endpoint, **view_args)
+        with self._lock:
+            for key in list(self._groups.get(group, ())):
+                self._discard(key)
+        if not has_app_context() or not current_app.config.get("PAGE_CACHE_ENABLED", True):
+            return
+        if has_request_context():
+            g.setdefault("page_invalidations", set()).add(group)
+        else:
+            bump_page_versions([group])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry[0])
+        keys = self._groups.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._groups[key[0]]
+
+
+page_cache = PageCache()
+
+
+def invalidate_tag_pages(tag_ids):
+    """Drop cached detail pages for the given tags and the tag list."""
+
+    page_cache.invalidate("blogly.view_tags")
+    for tag_id in tag_ids:
+        page_cache.invalidate("blogly.show_tag_details", tag_id=tag_id)
+
+
+def flush_invalidations(response):
+    groups = g.pop("page_invalidations", None)
+    if groups:
+        bump_page_versions(groups)
+    return response
+
+
+def init_page_cache(app):
+    """Size the shared page cache from PAGE_CACHE_MAX_ENTRIES/_MAX_BYTES/_TTL."""
+
+    app.config.setdefault("PAGE_CACHE_ENABLED", True)
+    page_cache.max_entries = app.config.get("PAGE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+    page_cache.max_bytes = app.config.get("PAGE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+    page_cache.ttl = app.config.get("PAGE_CACHE_TTL", DEFAULT_TTL)
+    app.after_request(flush_invalidations)
+
+
+def _not_modified(etag):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    return response
+
+
+def cached_page(view=None, *, version_groups=None):
+    """Serve view from the page cache, answering If-None-Match with 304.
+
+    version_groups, if given, is called with the view args and returns the
+    groups whose versions the page is checked against instead of its own.
+    """
+
+    if view is None:
+        return partial(cached_page, version_groups=version_groups)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_app.config.get("PAGE_CACHE_ENABLED", True):
+            return view(*args, **kwargs)
+
+        group = PageCache.group_key(request.endpoint, **request.view_args)
+        key = (group, request.query_string)
+
+        # Read before rendering, so the page is no older than its version.
+        groups = version_groups(**request.view_args) if version_groups else [group]
+        version = (tuple(groups), page_versions(groups))
+        entry = page_cache.get(key, version)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            page_cache.set(key, body, etag, response.mimetype, version)
+        else:
+            body, etag, mimetype = entry
+            response = make_response(body)
+            response.mimetype = mimetype
+
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+    return wrapper
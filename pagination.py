@@ -0,0 +1,126 @@
+"""Keyset (cursor) pagination for Blogly list views."""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import request, abort
+from sqlalchemy import tuple_
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+
+class Page:
+    """One page of results plus the cursors needed to move around."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Turn a tuple of key values into an opaque url-safe cursor."""
+
+    raw = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    data = json.dumps(raw, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor, columns):
+    """Turn a cursor back into key values, typed to match the columns."""
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(raw, list) or len(raw) != len(columns):
+            raise ValueError("cursor does not match key")
+        values = []
+        for value, column in zip(raw, columns):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                values.append(datetime.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+        return tuple(values)
+    except (ValueError, TypeError, NotImplementedError):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+
+
+def _key_of(item, columns):
+    return tuple(getattr(item, column.key) for column in columns)
+
+
+def paginate(query, columns, after=None, before=None,
+             per_page=DEFAULT_PER_PAGE, descending=False):
+    """Return a Page of query ordered by columns, starting after/before a cursor.
+
+    columns is a list of model columns that together form a unique,
+    indexed sort key, e.g. [Post.created_at, Post.id].
+    """
+
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    key = tuple_(*columns) if len(columns) > 1 else columns[0]
+    backwards = before is not None
+    # Walking backwards flips the sort so we can still use LIMIT.
+    reverse = descending != backwards
+
+    if after is not None:
+        values = decode_cursor(after, columns)
+        bound = values if len(columns) > 1 else values[0]
+        query = query.filter(key < bound if descending else key > bound)
+    elif before is not None:
+        values = decode_cursor(before, columns)
+        bound = values if len(columns) > 1 else values[0]
+        query = query.filter(key > bound if descending else key < bound)
+
+    order = [c.desc() if reverse else c.asc() for c in columns]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+
+    next_cursor = prev_cursor = None
+    if items:
+        first = encode_cursor(_key_of(items[0], columns))
+        last = encode_cursor(_key_of(items[-1], columns))
+        if backwards:
+            next_cursor = last
+            prev_cursor = first if more else None
+        else:
+            next_cursor = last if more else None
+            prev_cursor = first if after is not None else None
+
+    return Page(items, per_page, next_cursor, prev_cursor)
+
+
+def paginate_request(query, columns, descending=False):
+    """Paginate query using the after/before/per_page request args."""
+
+    per_page = request.args.get("per_page", DEFAULT_PER_PAGE, type=int)
+    try:
+        return paginate(query, columns,
+                        after=request.args.get("after"),
+                        before=request.args.get("before"),
+                        per_page=per_page,
+                        descending=descending)
+    except ValueError:
+        abort(400)
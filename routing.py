@@ -0,0 +1,71 @@
+"""Read/write splitting between the primary database and a read replica.
+
+When SQLALCHEMY_BINDS has a "replica" entry, GET and HEAD requests read
+from the replica and every other request uses the primary. After a
+browser makes a successful write, its reads stay on the primary for
+READ_YOUR_WRITES_SECONDS, so it sees its own change even while the
+replica lags. The window is kept in the signed session cookie.
+"""
+
+import time
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+
+REPLICA_BIND = "replica"
+READ_METHODS = ("GET", "HEAD")
+PRIMARY_UNTIL_KEY = "primary_until"
+
+
+def reading_from_replica():
+    """True while handling a request whose reads go to the replica."""
+
+    return has_app_context() and g.get("read_replica", False)
+
+
+class RoutingSession(Session):
+    """A session that sends reads to the replica in replica-routed requests.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and reading_from_replica()
+                and not self._flushing and not isinstance(clause, UpdateBase)):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+def has_replica(app):
+    return REPLICA_BIND in app.config.get("SQLALCHEMY_BINDS", {})
+
+
+def route_request():
+    """Read from the replica unless this is a write or the browser just wrote."""
+
+    g.read_replica = (request.method in READ_METHODS
+                      and session.get(PRIMARY_UNTIL_KEY, 0) <= time.time())
+
+
+def stick_to_primary(response):
+    """After a successful write, keep this browser's reads on the primary."""
+
+    if request.method not in READ_METHODS and response.status_code < 400:
+        session[PRIMARY_UNTIL_KEY] = time.time() + current_app.config["READ_YOUR_WRITES_SECONDS"]
+    return response
+
+
+def end_routing(exc):
+    g.pop("read_replica", None)
+
+
+def init_routing(app):
+    """Route requests between primary and replica if a replica is configured."""
+
+    if not has_replica(app):
+        return
+    app.before_request(route_request)
+    app.after_request(stick_to_primary)
+    app.teardown_request(end_routing)
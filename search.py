@@ -0,0 +1,240 @@
+"""Full-text search over post titles and content.
+
+On PostgreSQL, posts carry a generated tsvector column with a GIN index,
+so the database keeps it in sync on every insert and update. Other
+databases (SQLite in the tests) fall back to an in-process inverted index
+that the write routes keep current through index_post/unindex_posts.
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+
+from flask import request
+from sqlalchemy import DDL, event, func, literal_column, select
+from sqlalchemy.orm import joinedload
+
+from models import db, Post, PostTag
+from pagination import DEFAULT_PER_PAGE, MAX_PER_PAGE
+from bulk import blogly_cli
+
+SEARCH_CONFIG = "english"
+
+SEARCH_DDL = [
+    f"""ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(content, '')), 'B')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING GIN (search_vector)",
+]
+
+for statement in SEARCH_DDL:
+    event.listen(Post.__table__, "after_create",
+                 DDL(statement).execute_if(dialect="postgresql"))
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep `flask db migrate` from dropping the search column it cannot see."""
+
+    return name not in ("search_vector", "ix_posts_search_vector")
+
+
+def create_search_index():
+    """Add the search column and index to an existing PostgreSQL database."""
+
+    for statement in SEARCH_DDL:
+        db.session.execute(DDL(statement))
+    db.session.commit()
+
+
+@blogly_cli.command("init-search")
+def init_search_command():
+    """Add the full-text search column and GIN index to posts."""
+
+    create_search_index()
+
+
+class SearchResults:
+    """One page of ranked search hits."""
+
+    def __init__(self, query, posts, page, per_page, has_next, tag_ids=()):
+        self.query = query
+        self.tag_ids = list(tag_ids)
+        self.posts = posts
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    def __iter__(self):
+        return iter(self.posts)
+
+
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [word.lower() for word in WORD_RE.findall(text or "")]
+
+
+class InvertedIndex:
+    """term -> {post_id: term frequency}, built lazily from the posts table."""
+
+    TITLE_WEIGHT = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._terms_by_post = {}
+
+    @property
+    def built(self):
+        return self._postings is not None
+
+    def _terms(self, title, content):
+        terms = Counter(tokenize(content))
+        for word in tokenize(title):
+            terms[word] += self.TITLE_WEIGHT
+        return terms
+
+    def _add(self, post_id, title, content):
+        terms = self._terms(title, content)
+        self._terms_by_post[post_id] = terms
+        for term, count in terms.items():
+            self._postings.setdefault(term, {})[post_id] = count
+
+    def _remove(self, post_id):
+        for term in self._terms_by_post.pop(post_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(post_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def build(self):
+        with self._lock:
+            self._postings = {}
+            self._terms_by_post = {}
+            rows = db.session.execute(select(Post.id, Post.title, Post.content)
+                                      .execution_options(yield_per=1000))
+            for post_id, title, content in rows:
+                self._add(post_id, title, content)
+
+    def update(self, post_id, title, content):
+        with self._lock:
+            if self._postings is None:
+                return
+            self._remove(post_id)
+            self._add(post_id, title, content)
+
+    def remove(self, post_ids):
+        with self._lock:
+            if self._postings is None:
+                return
+            for post_id in post_ids:
+                self._remove(post_id)
+
+    def reset(self):
+        with self._lock:
+            self._postings = None
+            self._terms_by_post = {}
+
+    def search(self, query):
+        """Return [(post_id, score)] for posts containing every query term."""
+
+        if not self.built:
+            self.build()
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            total = max(len(self._terms_by_post), 1)
+            postings = [self._postings.get(term, {}) for term in terms]
+            if not all(postings):
+                return []
+            matches = set.intersection(*(set(p) for p in postings))
+            scores = {}
+            for p in postings:
+                idf = math.log(total / len(p)) + 1
+                for post_id in matches:
+                    scores[post_id] = scores.get(post_id, 0) + p[post_id] * idf
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+
+post_index = InvertedIndex()
+
+
+def index_post(post):
+    """Keep the fallback index current after a post is created or edited."""
+
+    if post_index.built:
+        post_index.update(post.id, post.title, post.content)
+
+
+def unindex_posts(post_ids):
+    """Drop deleted posts from the fallback index."""
+
+    post_index.remove(post_ids)
+
+
+def _tag_filter(tag_ids):
+    return select(PostTag.post_id).where(PostTag.tag_id.in_(tag_ids))
+
+
+def _postgres_hits(query, tag_ids, limit, offset):
+    vector = literal_column("posts.search_vector")
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+    rank = func.ts_rank(vector, tsquery)
+    stmt = (select(Post.id)
+            .where(vector.op("@@")(tsquery))
+            .order_by(rank.desc(), Post.id.desc())
+            .limit(limit)
+            .offset(offset))
+    if tag_ids:
+        stmt = stmt.where(Post.id.in_(_tag_filter(tag_ids)))
+    return db.session.scalars(stmt).all()
+
+
+def _fallback_hits(query, tag_ids, limit, offset):
+    hits = post_index.search(query)
+    if tag_ids:
+        allowed = set(db.session.scalars(_tag_filter(tag_ids)))
+        hits = [hit for hit in hits if hit[0] in allowed]
+    return [post_id for post_id, _ in hits[offset:offset + limit]]
+
+
+def search_posts(query, tag_ids=(), page=1, per_page=DEFAULT_PER_PAGE):
+    """Return a SearchResults page of posts matching query, best first."""
+
+    page = max(page, 1)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    offset = (page - 1) * per_page
+
+    if db.session.get_bind().dialect.name == "postgresql":
+        ids = _postgres_hits(query, tag_ids, per_page + 1, offset)
+    else:
+        ids = _fallback_hits(query, tag_ids, per_page + 1, offset)
+
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    by_id = {post.id: post for post in
+             Post.query.options(joinedload(Post.user)).filter(Post.id.in_(ids))}
+    posts = [by_id[post_id] for post_id in ids if post_id in by_id]
+    return SearchResults(query, posts, page, per_page, has_next, tag_ids)
+
+
+def search_from_request():
+    """Run search_posts with the q/tag/page/per_page request args."""
+
+    query = request.args.get("q", "").strip()
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", DEFAULT_PER_PAGE, type=int)
+    tag_ids = request.args.getlist("tag", type=int)
+    if not query:
+        return SearchResults(query, [], page, per_page, False, tag_ids)
+    return search_posts(query, tag_ids, page, per_page)
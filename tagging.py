@@ -0,0 +1,88 @@
+"""Diff-based updates to the post_tags association table.
+
+These work on post_tags rows directly instead of assigning post.tags or
+tag.posts, so only the links that actually change are touched and no
+Post or Tag objects have to be loaded. Callers commit.
+"""
+
+from sqlalchemy import delete, insert, select
+
+from models import db, Post, Tag, PostTag
+
+
+def _existing(model, ids):
+    """Return the subset of ids that exist in model's table."""
+
+    if not ids:
+        return set()
+    return set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+
+
+def _link(pairs):
+    pairs = list(pairs)
+    if pairs:
+        db.session.execute(insert(PostTag),
+                           [{"post_id": post_id, "tag_id": tag_id} for post_id, tag_id in pairs])
+
+
+def link_post_tags(post_id, tag_ids):
+    """Tag a new post with tag_ids, which the caller has already checked exist."""
+
+    _link((post_id, tag_id) for tag_id in set(tag_ids))
+
+
+def set_post_tags(post_id, tag_ids):
+    """Make tag_ids the tags of a post. Returns (added, removed) tag ids."""
+
+    current = set(db.session.scalars(select(PostTag.tag_id).filter_by(post_id=post_id)))
+    wanted = set(tag_ids)
+    added = _existing(Tag, wanted - current)
+    removed = current - wanted
+
+    if removed:
+        db.session.execute(delete(PostTag).where(PostTag.post_id == post_id,
+                                                 PostTag.tag_id.in_(removed)))
+    _link((post_id, tag_id) for tag_id in added)
+    return added, removed
+
+
+def set_tag_posts(tag_id, post_ids):
+    """Make post_ids the posts of a tag. Returns (added, removed) post ids."""
+
+    current = set(db.session.scalars(select(PostTag.post_id).filter_by(tag_id=tag_id)))
+    wanted = set(post_ids)
+    added = _existing(Post, wanted - current)
+    removed = current - wanted
+
+    if removed:
+        db.session.execute(delete(PostTag).where(PostTag.tag_id == tag_id,
+                                                 PostTag.post_id.in_(removed)))
+    _link((post_id, tag_id) for post_id in added)
+    return added, removed
+
+
+def add_tag_to_posts(tag_id, post_ids):
+    """Tag every post in post_ids that is not tagged yet. Returns the new post ids."""
+
+    wanted = set(post_ids)
+    if not wanted:
+        return set()
+    current = set(db.session.scalars(select(PostTag.post_id)
+                                     .where(PostTag.tag_id == tag_id,
+                                            PostTag.post_id.in_(wanted))))
+    added = _existing(Post, wanted - current)
+    _link((post_id, tag_id) for post_id in added)
+    return added
+
+
+def remove_tag_from_posts(tag_id, post_ids):
+    """Untag every post in post_ids. Returns the post ids that were untagged."""
+
+    wanted = set(post_ids)
+    if not wanted:
+        return set()
+    result = db.session.execute(delete(PostTag)
+                                .where(PostTag.tag_id == tag_id,
+                                       PostTag.post_id.in_(wanted))
+                                .returning(PostTag.post_id))
+    return set(result.scalars())
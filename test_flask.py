@@ -1,11 +1,22 @@
-from unittest import TestCase
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase, skipUnless
 
-from app import app
-from models import db, User, Post, Tag
+from app import create_app
+from models import db, User, Post, Tag, PostTag, PageVersion, user_summaries
+from pagination import paginate, encode_cursor
+from page_cache import PageCache, page_cache, page_versions, bump_page_versions
+from search import post_index, search_posts
+import benchmark
+import metrics
+from catalog import tag_catalog, catalog_version
+from avatars import SIZES
+from PIL import Image
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///bogly_test'
-
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app = create_app("test")
+app.app_context().push()
 
 db.drop_all()
 db.create_all()
@@ -158,4 +169,932 @@ class TagViewsTestCase(TestCase):
             resp = client.post('tags/1/delete', follow_redirects=True)
             deleted_tag = Tag.query.get(1)
             self.assertIsNone(deleted_tag)
-            self.assertEqual(resp.status_code, 200)
\ No newline at end of file
+            self.assertEqual(resp.status_code, 200)
+
+class DatabaseTestCase(TestCase):
+    """Runs each test against freshly created, empty tables."""
+
+    def setUp(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+class PaginationTestCase(DatabaseTestCase):
+    """Tests keyset pagination on list views."""
+
+    def setUp(self):
+        super().setUp()
+
+        users = [User(first_name=f"Page{i}", last_name="User") for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [u.id for u in users]
+
+    def test_first_page(self):
+        with app.test_client() as client:
+            resp = client.get("/users?per_page=2")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Page0', html)
+            self.assertIn('Page1', html)
+            self.assertNotIn('Page2', html)
+            self.assertIn('?after=', html)
+            self.assertNotIn('?before=', html)
+
+    def test_follow_cursors(self):
+        page = paginate(User.query, [User.id], per_page=2)
+        page = paginate(User.query, [User.id], after=page.next_cursor, per_page=2)
+        self.assertEqual([u.first_name for u in page], ["Page2", "Page3"])
+
+        back = paginate(User.query, [User.id], before=page.prev_cursor, per_page=2)
+        self.assertEqual([u.first_name for u in back], ["Page0", "Page1"])
+        self.assertFalse(back.has_prev)
+
+    def test_bad_cursor(self):
+        with app.test_client() as client:
+            resp = client.get("/users?after=not-a-cursor")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_cursor_values_must_match_column_types(self):
+        forged = encode_cursor(["x"])
+        with app.test_client() as client:
+            self.assertEqual(client.get(f"/users?after={forged}").status_code, 400)
+
+
+class EagerLoadingTestCase(DatabaseTestCase):
+    """Tests that edit forms mark the current tag associations."""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User(first_name="Eager", last_name="Loader")
+        tag = Tag(tag_name="Chosen")
+        other = Tag(tag_name="Other")
+        post = Post(title="Tagged", content="Body", user=user, tags=[tag])
+        db.session.add_all([user, tag, other, post])
+        db.session.commit()
+
+        self.post_id = post.id
+        self.tag_id = tag.id
+        self.other_id = other.id
+
+    def test_edit_post_marks_selected_tags(self):
+        with app.test_client() as client:
+            resp = client.get(f"/posts/{self.post_id}/edit")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertRegex(html, rf'id="tag_{self.tag_id}"\s+checked')
+            self.assertNotRegex(html, rf'id="tag_{self.other_id}"\s+checked')
+
+    def test_edit_tag_marks_selected_posts(self):
+        with app.test_client() as client:
+            resp = client.get(f"/tags/{self.tag_id}/edit")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('checked', html)
+
+    def test_post_details_shows_author_and_tags(self):
+        with app.test_client() as client:
+            resp = client.get(f"/posts/{self.post_id}")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("Eager Loader", html)
+            self.assertIn("Chosen", html)
+
+
+class MetricsTestCase(DatabaseTestCase):
+    """Tests request instrumentation and the /metrics endpoint."""
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset_metrics()
+
+    def test_records_queries_per_route(self):
+        with app.test_client() as client:
+            client.get("/users")
+            counts, total = metrics.query_count.snapshot()["blogly.list_users"]
+
+            self.assertEqual(sum(counts), 1)
+            self.assertGreaterEqual(total, 1)
+
+    def test_metrics_endpoint(self):
+        with app.test_client() as client:
+            client.get("/tags")
+            resp = client.get("/metrics")
+            text = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('# TYPE blogly_request_seconds histogram', text)
+            self.assertIn('blogly_request_queries_count{endpoint="blogly.view_tags"} 1', text)
+
+    def test_slow_query_log(self):
+        old = metrics._slow_query_threshold
+        metrics._slow_query_threshold = 0
+        try:
+            with self.assertLogs("blogly.slow_query", level="WARNING"):
+                User.query.count()
+        finally:
+            metrics._slow_query_threshold = old
+
+
+class PageCacheTestCase(DatabaseTestCase):
+    """Tests the rendered-page cache and its invalidation."""
+
+    def setUp(self):
+        super().setUp()
+        page_cache.clear()
+        app.config['PAGE_CACHE_ENABLED'] = True
+
+        user = User(first_name="Cached", last_name="User")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        app.config['PAGE_CACHE_ENABLED'] = False
+        page_cache.clear()
+        super().tearDown()
+
+    def test_etag_not_modified(self):
+        with app.test_client() as client:
+            resp = client.get("/users")
+            etag = resp.headers["ETag"]
+
+            resp = client.get("/users", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+
+    def test_write_invalidates_page(self):
+        with app.test_client() as client:
+            client.get("/users")
+            d = {"first_name": "Renamed", "last_name": "User", "image_url": ""}
+            client.post(f"/users/{self.user_id}/edit", data=d)
+
+            resp = client.get("/users")
+            self.assertIn("Renamed", resp.get_data(as_text=True))
+
+    def test_rename_invalidates_tag_pages(self):
+        tag = Tag(tag_name="cached")
+        db.session.add(Post(title="Tagged", content="body", user_id=self.user_id, tags=[tag]))
+        db.session.commit()
+
+        with app.test_client() as client:
+            client.get(f"/tags/{tag.id}")
+            d = {"first_name": "Renamed", "last_name": "User", "image_url": ""}
+            client.post(f"/users/{self.user_id}/edit", data=d)
+
+            resp = client.get(f"/tags/{tag.id}")
+            self.assertIn("by Renamed User", resp.get_data(as_text=True))
+
+    def test_lru_eviction(self):
+        cache = PageCache(max_entries=2)
+        for n in range(3):
+            cache.set((PageCache.group_key("view", n=n), b""), b"body", "etag", "text/html", 0)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get((PageCache.group_key("view", n=0), b""), 0))
+
+    def test_invalidate_drops_every_page_of_group(self):
+        cache = PageCache()
+        group = PageCache.group_key("show_user", user_id=1)
+        cache.set((group, b""), b"one", "a", "text/html", 0)
+        cache.set((group, b"after=x"), b"two", "b", "text/html", 0)
+        cache.set((PageCache.group_key("show_user", user_id=2), b""), b"three", "c", "text/html", 0)
+
+        cache.invalidate("show_user", user_id=1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(page_versions([group]), (1,))
+
+    def test_page_rendered_before_invalidation_is_not_served(self):
+        cache = PageCache()
+        group = PageCache.group_key("show_user", user_id=1)
+        version = page_versions([group])
+        cache.invalidate("show_user", user_id=1)
+        cache.set((group, b""), b"stale", "a", "text/html", version)
+
+        self.assertIsNone(cache.get((group, b""), page_versions([group])))
+
+    def test_entries_expire(self):
+        cache = PageCache(ttl=0)
+        key = (PageCache.group_key("view"), b"")
+        cache.set(key, b"body", "etag", "text/html", 0)
+
+        self.assertIsNone(cache.get(key, 0))
+
+    def test_invalidation_in_another_process(self):
+        with app.test_client() as client:
+            client.get("/users")
+            # Another worker renames the user and bumps the shared version;
+            # this process's copy of the page is untouched.
+            User.query.get(self.user_id).first_name = "Elsewhere"
+            db.session.commit()
+            bump_page_versions([PageCache.group_key("blogly.list_users")])
+
+            self.assertIn("Elsewhere", client.get("/users").get_data(as_text=True))
+
+    def test_post_pages_follow_author_and_tags(self):
+        tag = Tag(tag_name="before")
+        post = Post(title="Followed", content="body", user_id=self.user_id, tags=[tag])
+        db.session.add(post)
+        db.session.commit()
+
+        with app.test_client() as client:
+            client.get(f"/posts/{post.id}")
+            client.post(f"/users/{self.user_id}/edit",
+                        data={"first_name": "Renamed", "last_name": "User", "image_url": ""})
+            client.post(f"/tags/{tag.id}/edit", data={"tag_name": "after", "posts": [post.id]})
+
+            html = client.get(f"/posts/{post.id}").get_data(as_text=True)
+            self.assertIn("Renamed User", html)
+            self.assertIn("after", html)
+
+    def test_invalidation_cost_does_not_grow_with_posts(self):
+        tag = Tag(tag_name="busy")
+        db.session.add_all([Post(title=f"P{n}", content="body", user_id=self.user_id, tags=[tag])
+                            for n in range(12)])
+        db.session.commit()
+        d = {"first_name": "Renamed", "last_name": "User", "image_url": ""}
+
+        with app.test_client() as client, benchmark.StatementRecorder() as recorder:
+            client.post(f"/users/{self.user_id}/edit", data=d)
+        upserts = [sql for sql, _ in recorder.statements if "page_versions" in sql]
+
+        self.assertEqual(len(upserts), 1)
+        self.assertLessEqual(len(recorder.statements), 4)
+
+    def test_disabled_cache_writes_no_versions(self):
+        app.config['PAGE_CACHE_ENABLED'] = False
+        with app.test_client() as client:
+            client.post(f"/users/{self.user_id}/edit",
+                        data={"first_name": "Renamed", "last_name": "User", "image_url": ""})
+
+        self.assertEqual(db.session.query(PageVersion).count(), 0)
+
+
+class BulkCommandsTestCase(DatabaseTestCase):
+    """Tests the flask blogly import/export commands."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.runner = app.test_cli_runner()
+
+    def tearDown(self):
+        self.dir.cleanup()
+        super().tearDown()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_import_users_and_posts_with_tags(self):
+        users = self.write("users.csv", "id,first_name,last_name,image_url\n7,Bulk,User,\n")
+        posts = self.write("posts.jsonl",
+                           '{"title": "One", "content": "A", "user_id": 7, "tags": ["x", "y"]}\n'
+                           '{"title": "Two", "content": "B", "user_id": 7, "tags": ["y"]}\n')
+
+        result = self.runner.invoke(args=["blogly", "import", "users", users])
+        self.assertEqual(result.exit_code, 0, result.output)
+        result = self.runner.invoke(args=["blogly", "import", "posts", posts, "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        self.assertIsNotNone(User.query.get(7).image_url)
+        self.assertEqual(Tag.query.count(), 2)
+        y = Tag.query.filter_by(tag_name="y").one()
+        self.assertEqual(sorted(p.title for p in y.posts), ["One", "Two"])
+
+    def test_export_jsonl(self):
+        db.session.add(User(first_name="Out", last_name="Bound"))
+        db.session.commit()
+
+        path = os.path.join(self.dir.name, "users.jsonl")
+        result = self.runner.invoke(args=["blogly", "export", "users", path])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with open(path) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([r["first_name"] for r in rows], ["Out"])
+
+
+class SearchTestCase(DatabaseTestCase):
+    """Tests full-text search over posts."""
+
+    def setUp(self):
+        super().setUp()
+        post_index.reset()
+
+        user = User(first_name="Search", last_name="Er")
+        tag = Tag(tag_name="Flask")
+        db.session.add_all([
+            user, tag,
+            Post(title="Flask tips", content="Use blueprints", user=user, tags=[tag]),
+            Post(title="Cooking", content="Flask of soup and flask of tea", user=user),
+            Post(title="Gardening", content="Tomatoes", user=user),
+        ])
+        db.session.commit()
+        self.user_id = user.id
+        self.tag_id = tag.id
+
+    def test_ranked_results(self):
+        results = search_posts("flask")
+        self.assertEqual(len(results.posts), 2)
+        self.assertFalse(results.has_next)
+
+    def test_tag_filter(self):
+        results = search_posts("flask", tag_ids=[self.tag_id])
+        self.assertEqual([p.title for p in results], ["Flask tips"])
+
+    def test_paging(self):
+        results = search_posts("flask", per_page=1)
+        self.assertTrue(results.has_next)
+        self.assertEqual(len(search_posts("flask", page=2, per_page=1).posts), 1)
+
+    def test_new_post_is_searchable(self):
+        search_posts("flask")
+        with app.test_client() as client:
+            client.post(f"/users/{self.user_id}/posts_new",
+                        data={"post_title": "Zucchini", "post_content": "Green"})
+            resp = client.get("/api/search?q=zucchini")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([r["title"] for r in resp.json["results"]], ["Zucchini"])
+
+    def test_search_page(self):
+        with app.test_client() as client:
+            resp = client.get("/search?q=tomatoes")
+            self.assertIn("Gardening", resp.get_data(as_text=True))
+
+
+class TaggingTestCase(DatabaseTestCase):
+    """Tests diff-based tag association updates."""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User(first_name="Tag", last_name="Ger")
+        self.tags = [Tag(tag_name=name) for name in ("a", "b", "c")]
+        self.posts = [Post(title=f"P{n}", content="x", user=user) for n in range(3)]
+        self.posts[0].tags = self.tags[:2]
+        db.session.add_all([user] + self.tags + self.posts)
+        db.session.commit()
+
+    def links(self):
+        return {(link.post_id, link.tag_id) for link in PostTag.query.all()}
+
+    def test_edit_post_only_changes_diff(self):
+        post, (a, b, c) = self.posts[0], self.tags
+        with app.test_client() as client:
+            client.post(f"/posts/{post.id}/edit",
+                        data={"post_title": "P0", "post_content": "x", "tags": [b.id, c.id]})
+
+        self.assertNotIn((post.id, a.id), self.links())
+        self.assertEqual(self.links(), {(post.id, b.id), (post.id, c.id)})
+
+    def test_edit_tag_only_changes_diff(self):
+        a = self.tags[0]
+        p0, p1, p2 = self.posts
+        with app.test_client() as client:
+            client.post(f"/tags/{a.id}/edit", data={"tag_name": "a", "posts": [p1.id, p2.id]})
+
+        self.assertEqual({link for link in self.links() if link[1] == a.id},
+                         {(p1.id, a.id), (p2.id, a.id)})
+
+    def test_bulk_tagging(self):
+        c = self.tags[2]
+        p0, p1, p2 = self.posts
+        with app.test_client() as client:
+            resp = client.post(f"/api/tags/{c.id}/posts",
+                               json={"add": [p0.id, p1.id, p2.id, 9999]})
+            self.assertEqual(resp.json["added"], sorted([p0.id, p1.id, p2.id]))
+
+            resp = client.post(f"/api/tags/{c.id}/posts", json={"remove": [p1.id]})
+            self.assertEqual(resp.json["removed"], [p1.id])
+
+        self.assertEqual({link for link in self.links() if link[1] == c.id},
+                         {(p0.id, c.id), (p2.id, c.id)})
+
+    def test_bulk_tagging_bad_body(self):
+        with app.test_client() as client:
+            resp = client.post(f"/api/tags/{self.tags[0].id}/posts", json={"add": ["x"]})
+            self.assertEqual(resp.status_code, 400)
+
+
+class CascadeDeleteTestCase(DatabaseTestCase):
+    """Tests that deletes cascade in the database."""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User(first_name="Cascade", last_name="User")
+        tag = Tag(tag_name="gone")
+        posts = [Post(title=f"P{n}", content="x", user=user, tags=[tag]) for n in range(3)]
+        db.session.add_all([user, tag] + posts)
+        db.session.commit()
+        self.user_id = user.id
+        self.tag_id = tag.id
+        self.post_id = posts[0].id
+        db.session.expunge_all()
+
+    def test_delete_user_removes_posts_and_links(self):
+        with app.test_client() as client:
+            resp = client.post(f"/users/{self.user_id}/delete")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Post.query.count(), 0)
+            self.assertEqual(PostTag.query.count(), 0)
+            self.assertIsNotNone(db.session.get(Tag, self.tag_id))
+
+    def test_delete_post_removes_links(self):
+        with app.test_client() as client:
+            client.post(f"/posts/{self.post_id}/delete")
+
+            self.assertEqual(PostTag.query.filter_by(post_id=self.post_id).count(), 0)
+            self.assertEqual(PostTag.query.count(), 2)
+
+    def test_delete_tag_keeps_posts(self):
+        with app.test_client() as client:
+            client.post(f"/tags/{self.tag_id}/delete")
+
+            self.assertEqual(PostTag.query.count(), 0)
+            self.assertEqual(Post.query.count(), 3)
+
+    def test_delete_missing_user(self):
+        with app.test_client() as client:
+            resp = client.post("/users/9999/delete")
+            self.assertEqual(resp.status_code, 404)
+
+
+class PostSummaryTestCase(DatabaseTestCase):
+    """Tests deferred post bodies and stored excerpts."""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User(first_name="Sum", last_name="Mary")
+        tag = Tag(tag_name="long")
+        post = Post(title="Long read", content="word " * 100, user=user, tags=[tag])
+        db.session.add_all([user, tag, post])
+        db.session.commit()
+        self.user_id = user.id
+        self.tag_id = tag.id
+        self.post_id = post.id
+        db.session.expunge_all()
+
+    def test_excerpt_follows_content(self):
+        post = db.session.get(Post, self.post_id)
+        self.assertTrue(post.excerpt.endswith("\u2026"))
+        self.assertLessEqual(len(post.excerpt), 201)
+
+        post.content = "Short now"
+        db.session.commit()
+        self.assertEqual(post.excerpt, "Short now")
+
+    def test_content_is_deferred(self):
+        post = db.session.get(Post, self.post_id)
+        self.assertNotIn("content", post.__dict__)
+
+    def test_list_pages_show_excerpt(self):
+        with app.test_client() as client:
+            for url in (f"/{self.user_id}", f"/tags/{self.tag_id}"):
+                html = client.get(url).get_data(as_text=True)
+                self.assertIn("Long read", html)
+                self.assertIn("word word", html)
+
+    def test_refresh_excerpts_command(self):
+        db.session.execute(db.update(Post).values(excerpt=""))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=["blogly", "refresh-excerpts"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue(db.session.get(Post, self.post_id).excerpt.startswith("word"))
+
+
+class BenchmarkTestCase(DatabaseTestCase):
+    """Tests the synthetic data generator and workload driver."""
+
+    def setUp(self):
+        super().setUp()
+        post_index.reset()
+
+    def tearDown(self):
+        app.config['PAGE_CACHE_ENABLED'] = False
+        super().tearDown()
+
+    def test_seed_is_reproducible(self):
+        benchmark.seed_database(users=5, posts=20, tags=4, seed=42)
+        first = [(p.title, p.user_id) for p in Post.query.order_by(Post.id)]
+
+        db.drop_all()
+        db.create_all()
+        benchmark.seed_database(users=5, posts=20, tags=4, seed=42)
+        second = [(p.title, p.user_id) for p in Post.query.order_by(Post.id)]
+
+        self.assertEqual(len(first), 20)
+        self.assertEqual(first, second)
+
+    def test_run_and_compare(self):
+        benchmark.seed_database(users=5, posts=20, tags=4, seed=1)
+        with app.app_context():
+            report = benchmark.run_workload(200, seed=1)
+
+        self.assertEqual(sum(r["requests"] for r in report["routes"].values()), 200)
+        self.assertEqual(sum(r["errors"] for r in report["routes"].values()), 0)
+        self.assertEqual(benchmark.compare_reports(report, report), [])
+
+        more_queries = json.loads(json.dumps(report))
+        more_queries["routes"]["list_users"]["max_queries"] += 1
+        self.assertEqual(len(benchmark.compare_reports(more_queries, report)), 1)
+
+        slower = json.loads(json.dumps(report))
+        slower["routes"]["list_users"]["p95_ms"] = report["routes"]["list_users"]["p95_ms"] * 2 + 1
+        self.assertEqual(len(benchmark.compare_reports(slower, report)), 1)
+
+    def test_run_command_saves_baseline(self):
+        benchmark.seed_database(users=3, posts=10, tags=2, seed=2)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "baseline.json")
+            result = app.test_cli_runner().invoke(
+                args=["bench", "run", "--requests", "50", "--save", path])
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(path) as f:
+                self.assertIn("routes", json.load(f))
+
+
+class ExplainTestCase(DatabaseTestCase):
+    """Tests that no route's queries read a whole table or index."""
+
+    def setUp(self):
+        super().setUp()
+        post_index.reset()
+
+    def test_full_scans_walks_the_plan(self):
+        plan = {"Node Type": "Nested Loop", "Plans": [
+            {"Node Type": "Index Scan", "Relation Name": "users", "Index Cond": "(id = 1)"},
+            {"Node Type": "Hash", "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "post_tags"}]}]}
+
+        self.assertEqual(list(benchmark.full_scans(plan)), [("post_tags", "Seq Scan")])
+
+    def test_full_scans_flags_whole_index_walks(self):
+        filtered = {"Node Type": "Limit", "Plans": [
+            {"Node Type": "Index Scan", "Relation Name": "posts", "Filter": "(title = 'x')"}]}
+        unlimited = {"Node Type": "Index Only Scan", "Relation Name": "tags"}
+        sorted_page = {"Node Type": "Limit", "Plans": [{"Node Type": "Sort", "Plans": [
+            {"Node Type": "Index Scan", "Relation Name": "users"}]}]}
+        ordered_page = {"Node Type": "Limit", "Plans": [{"Node Type": "Nested Loop", "Plans": [
+            {"Node Type": "Index Scan", "Relation Name": "posts"},
+            {"Node Type": "Index Scan", "Relation Name": "users", "Index Cond": "(id = posts.user_id)"}]}]}
+
+        self.assertEqual(list(benchmark.full_scans(filtered)), [("posts", "Index Scan")])
+        self.assertEqual(list(benchmark.full_scans(unlimited)), [("tags", "Index Only Scan")])
+        self.assertEqual(list(benchmark.full_scans(sorted_page)), [("users", "Index Scan")])
+        self.assertEqual(list(benchmark.full_scans(ordered_page)), [])
+
+    def test_indexes_declared(self):
+        index_columns = {tuple(c.name for c in index.columns)
+                         for model in (Post, PostTag, Tag)
+                         for index in model.__table__.indexes}
+
+        self.assertIn(("user_id", "created_at", "id"), index_columns)
+        self.assertIn(("tag_id", "post_id"), index_columns)
+        self.assertIn(("tag_name",), index_columns)
+
+    @skipUnless(db.engine.dialect.name == "postgresql", "EXPLAIN plans need PostgreSQL")
+    def test_no_sequential_scans(self):
+        benchmark.seed_database(users=2000, posts=20000, tags=200, seed=3)
+        benchmark.analyze()
+
+        problems = benchmark.explain_workload(seed=3)
+
+        self.assertEqual(problems, [], "\n".join(f"{name}: {node} on {table}"
+                                             for name, table, node, _ in problems))
+
+
+class AppFactoryTestCase(TestCase):
+    """Tests the app factory profiles."""
+
+    def test_test_profile(self):
+        self.assertTrue(app.testing)
+        self.assertNotIn("debugtoolbar", app.extensions)
+        self.assertFalse(app.config["PAGE_CACHE_ENABLED"])
+
+    def test_prod_profile_needs_secret_key(self):
+        from config import ProdConfig
+
+        old = ProdConfig.SECRET_KEY
+        ProdConfig.SECRET_KEY = None
+        try:
+            with self.assertRaises(RuntimeError):
+                create_app("prod")
+        finally:
+            ProdConfig.SECRET_KEY = old
+
+    def test_prod_profile_pool(self):
+        from config import ProdConfig
+
+        options = ProdConfig.SQLALCHEMY_ENGINE_OPTIONS
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertGreater(options["pool_size"], 0)
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Tests read/write routing with two SQLite files as primary and replica."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = create_app("test", {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(self.tmp.name, 'primary.db')}",
+            "SQLALCHEMY_BINDS": {"replica": f"sqlite:///{os.path.join(self.tmp.name, 'replica.db')}"},
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.metadata.create_all(db.engines["replica"])
+
+        db.session.add(User(first_name="Primary", last_name="Only"))
+        db.session.commit()
+        with db.engines["replica"].begin() as conn:
+            conn.execute(User.__table__.insert(),
+                         {"first_name": "Replica", "last_name": "Copy", "image_url": "", "post_count": 0})
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+        self.ctx.pop()
+        self.tmp.cleanup()
+        # init_app registered the bind on the shared db; the other apps have no replica.
+        db.metadatas.pop("replica", None)
+
+    def test_reads_use_replica(self):
+        with self.app.test_client() as client:
+            html = client.get("/users").get_data(as_text=True)
+
+            self.assertIn("Replica Copy", html)
+            self.assertNotIn("Primary Only", html)
+
+    def test_writes_use_primary(self):
+        with self.app.test_client() as client:
+            client.post("/new_user", data={"first_name": "Fresh", "last_name": "Writer",
+                                           "image_url": ""})
+
+        self.assertIsNotNone(User.query.filter_by(last_name="Writer").first())
+        with db.engines["replica"].connect() as conn:
+            self.assertEqual(conn.execute(User.__table__.select()
+                                          .where(User.last_name == "Writer")).all(), [])
+
+    def test_read_your_writes(self):
+        with self.app.test_client() as client:
+            client.post("/new_user", data={"first_name": "Fresh", "last_name": "Writer",
+                                           "image_url": ""})
+            self.assertIn("Fresh Writer", client.get("/users").get_data(as_text=True))
+
+            with client.session_transaction() as session:
+                session["primary_until"] = 0
+            self.assertNotIn("Fresh Writer", client.get("/users").get_data(as_text=True))
+
+        with self.app.test_client() as other:
+            self.assertNotIn("Fresh Writer", other.get("/users").get_data(as_text=True))
+
+
+class StreamingApiTestCase(DatabaseTestCase):
+    """Tests the read-only streaming JSON API."""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User(first_name="Api", last_name="User")
+        tag = Tag(tag_name="api")
+        posts = [Post(title=f"P{n}", content="body", user=user, tags=[tag] if n else [])
+                 for n in range(3)]
+        db.session.add_all([user, tag] + posts)
+        db.session.commit()
+        self.user_id = user.id
+        self.tag_id = tag.id
+        self.post_ids = [p.id for p in posts]
+
+    def lines(self, resp):
+        return [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+    def test_posts_ndjson(self):
+        with app.test_client() as client:
+            resp = client.get("/api/posts")
+
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            rows = self.lines(resp)
+            self.assertEqual([r["id"] for r in rows], self.post_ids)
+            self.assertNotIn("content", rows[0])
+
+    def test_json_array_and_resume(self):
+        with app.test_client() as client:
+            resp = client.get(f"/api/posts?format=json&after_id={self.post_ids[0]}")
+            self.assertEqual([r["id"] for r in resp.json], self.post_ids[1:])
+
+    def test_tag_posts(self):
+        with app.test_client() as client:
+            rows = self.lines(client.get(f"/api/tags/{self.tag_id}/posts"))
+            self.assertEqual([r["id"] for r in rows], self.post_ids[1:])
+
+    def test_single_post_and_user(self):
+        with app.test_client() as client:
+            post = client.get(f"/api/posts/{self.post_ids[1]}").json
+            self.assertEqual(post["content"], "body")
+            self.assertEqual(post["tag_ids"], [self.tag_id])
+
+            self.assertEqual(client.get(f"/api/users/{self.user_id}").json["first_name"], "Api")
+            self.assertEqual(client.get("/api/users/9999").status_code, 404)
+
+    def test_users_and_tags(self):
+        with app.test_client() as client:
+            self.assertEqual(len(self.lines(client.get("/api/users"))), 1)
+            self.assertEqual(self.lines(client.get("/api/tags"))[0]["tag_name"], "api")
+
+
+class PostCountTestCase(DatabaseTestCase):
+    """Tests the denormalized post counts on users and tags."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(first_name="Count", last_name="Er")
+        self.other = User(first_name="Quiet", last_name="One")
+        self.tags = [Tag(tag_name="t1"), Tag(tag_name="t2")]
+        db.session.add_all([self.user, self.other] + self.tags)
+        db.session.commit()
+        self.user_id, self.other_id = self.user.id, self.other.id
+        self.t1, self.t2 = (t.id for t in self.tags)
+
+    def counts(self):
+        db.session.expire_all()
+        return (db.session.get(User, self.user_id).post_count,
+                db.session.get(Tag, self.t1).post_count,
+                db.session.get(Tag, self.t2).post_count)
+
+    def new_post(self, client, tags):
+        client.post(f"/users/{self.user_id}/posts_new",
+                    data={"post_title": "T", "post_content": "C", "tags": tags})
+        return db.session.scalar(db.select(db.func.max(Post.id)))
+
+    def test_counts_follow_writes(self):
+        with app.test_client() as client:
+            first = self.new_post(client, [self.t1])
+            self.new_post(client, [self.t1, self.t2])
+            self.assertEqual(self.counts(), (2, 2, 1))
+
+            client.post(f"/posts/{first}/edit",
+                        data={"post_title": "T", "post_content": "C", "tags": [self.t2]})
+            self.assertEqual(self.counts(), (2, 1, 2))
+
+            client.post(f"/tags/{self.t1}/edit", data={"tag_name": "t1", "posts": [first]})
+            self.assertEqual(self.counts(), (2, 1, 2))
+
+            client.post(f"/posts/{first}/delete")
+            self.assertEqual(self.counts(), (1, 0, 1))
+
+            client.post(f"/users/{self.user_id}/delete")
+            db.session.expire_all()
+            self.assertEqual(db.session.get(Tag, self.t2).post_count, 0)
+
+    def test_recount_command(self):
+        db.session.add(Post(title="T", content="C", user_id=self.user_id,
+                            tags=[db.session.get(Tag, self.t1)]))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=["blogly", "recount"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.counts(), (1, 1, 0))
+
+    def test_sort_by_popularity(self):
+        db.session.get(User, self.other_id).post_count = 5
+        db.session.commit()
+        with app.test_client() as client:
+            html = client.get("/users?sort=popular").get_data(as_text=True)
+            self.assertLess(html.index("Quiet One"), html.index("Count Er"))
+
+    def test_popular_listing_is_covered_by_its_index(self):
+        index = next(index for index in User.__table__.indexes
+                     if index.name == "ix_users_post_count_id")
+        covered = ({column.name for column in index.columns}
+                   | set(index.dialect_options["postgresql"]["include"]))
+
+        self.assertLessEqual({column["name"] for column in user_summaries().column_descriptions},
+                             covered)
+
+
+class TagCatalogTestCase(DatabaseTestCase):
+    """Tests the cached tag catalog and its version checks."""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User(first_name="Cat", last_name="Alog")
+        db.session.add_all([user, Tag(tag_name="beta"), Tag(tag_name="alpha")])
+        db.session.commit()
+        self.user_id = user.id
+
+    def test_sorted_and_cached(self):
+        self.assertEqual([tag.tag_name for tag in tag_catalog.tags()], ["alpha", "beta"])
+
+        # Without a version bump the cached copy is served.
+        db.session.add(Tag(tag_name="gamma"))
+        db.session.commit()
+        self.assertNotIn("gamma", tag_catalog.names().values())
+
+    def test_tag_routes_bump_version(self):
+        with app.test_client() as client:
+            version = catalog_version()
+            client.post("/tags_new", data={"tag_name": "gamma"})
+            self.assertEqual(catalog_version(), version + 1)
+            self.assertIn("gamma", client.get(f"/users/{self.user_id}/posts_new")
+                          .get_data(as_text=True))
+
+            tag_id = Tag.query.filter_by(tag_name="gamma").one().id
+            client.post(f"/tags/{tag_id}/edit", data={"tag_name": "delta"})
+            self.assertIn("delta", tag_catalog.names().values())
+
+            client.post(f"/tags/{tag_id}/delete")
+            self.assertNotIn(tag_id, tag_catalog.names())
+
+    def test_new_post_ignores_unknown_tags(self):
+        alpha = Tag.query.filter_by(tag_name="alpha").one().id
+        with app.test_client() as client:
+            client.post(f"/users/{self.user_id}/posts_new",
+                        data={"post_title": "T", "post_content": "C", "tags": [alpha, 9999]})
+
+        self.assertEqual([link.tag_id for link in PostTag.query], [alpha])
+
+
+class AvatarTestCase(DatabaseTestCase):
+    """Tests the local avatar store and its thumbnail route."""
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_dir = app.config["AVATAR_DIR"]
+        app.config["AVATAR_DIR"] = self.tmp.name
+
+    def tearDown(self):
+        app.config["AVATAR_DIR"] = self.old_dir
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def png(self, size=(400, 300)):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def test_upload_makes_cacheable_thumbnails(self):
+        with app.test_client() as client:
+            client.post("/new_user", data={"first_name": "Ava", "last_name": "Tar", "image_url": "",
+                                           "avatar": (io.BytesIO(self.png()), "me.png")})
+            digest = User.query.filter_by(last_name="Tar").one().avatar
+            self.assertRegex(digest, r"^[0-9a-f]{64}$")
+
+            url = f"/avatars/small/{digest}.webp"
+            self.assertIn(url, client.get("/users").get_data(as_text=True))
+
+            resp = client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("immutable", resp.headers["Cache-Control"])
+            self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+            self.assertEqual(Image.open(io.BytesIO(resp.data)).size, (SIZES["small"],) * 2)
+
+    def test_initials_avatar_drawn_in_memory(self):
+        user = User(first_name="Bea", last_name="Default")
+        db.session.add(user)
+        db.session.commit()
+
+        with app.test_client() as client:
+            html = client.get(f"/{user.id}").get_data(as_text=True)
+            self.assertIn("/avatars/large/i-BD-", html)
+            url = html.split('src="', 1)[1].split('"', 1)[0]
+
+            resp = client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(Image.open(io.BytesIO(resp.data)).size, (SIZES["large"],) * 2)
+            self.assertIn("immutable", resp.headers["Cache-Control"])
+            self.assertEqual(client.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+                             .status_code, 304)
+            self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_rejects_bad_uploads_and_keys(self):
+        with app.test_client() as client:
+            resp = client.post("/new_user", data={"first_name": "Not", "last_name": "Image",
+                                                  "image_url": "",
+                                                  "avatar": (io.BytesIO(b"plain text"), "x.png")})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(client.get(f"/avatars/small/{'0' * 64}.webp").status_code, 404)
+            self.assertEqual(client.get("/avatars/huge/i-AB-1.webp").status_code, 404)
+            self.assertEqual(client.get("/avatars/small/i-AB-7.webp").status_code, 404)
+            self.assertEqual(client.get("/avatars/small/i-ABC-1.webp").status_code, 404)
+